@@ -1,41 +1,93 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda
 import os
-from langchain_community.llms import LlamaCpp
-
-from chunking_embedding import retriever_function
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from chat_history import update_final_answer
+from chunking_embedding import retriever_function, chunk_store
+from conversation import condense_question, recent_questions, record_question
+from inference import InferenceBusy, generate, submit_generation
+from model_config import env_int
+from kb_shards import KB_SHARDING, shard_name
+from text_extraction import get_pdf_records
 from semantic_caching import search_cache, store_in_chroma, generate_cache_id, save_cache_to_chat_history, get_from_chat_history
 
 
 
-def load_llm():
-    local_llm = LlamaCpp(
-        #model_path=r"models\Phi-3-mini-4k-instruct-q4.gguf",
-        # model_path=r"models\llama-2-7b-chat.Q4_K_M.gguf", 
-        # model_path=r"models\mistral-7b-instruct-v0.2.Q4_K_M.gguf",
-        # model_path=r"models\tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
-        #model_path=r"models\mistral-4.2B.Q4_K.gguf",
-        model_path=r"models\Llama-3.2-3B-Instruct-Q4_K_M.gguf",
-        n_ctx=2048,
-        n_threads=6,
-        n_gpu_layers=0,
-        temperature=0.3,
-        max_tokens=200,
-        stop=["Note"], 
-        verbose=False 
+vector_store = retriever_function()
+
+
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER")
+
+# Interactive requests only: bulk jobs wait as long as generation takes
+RETRIEVAL_TIMEOUT = env_int("RETRIEVAL_TIMEOUT", 15)
+GENERATION_TIMEOUT = env_int("GENERATION_TIMEOUT", 45)
+
+BUSY_MESSAGE = "The assistant is busy right now. Please ask again in a moment."
+RETRIEVAL_TIMEOUT_MESSAGE = "Searching the knowledge base took too long. Please ask again."
+GENERATION_FAILED_MESSAGE = "The answer could not be generated. Please ask again."
+
+_stage_pool = None
+_stage_pool_pid = None
+_stage_lock = threading.Lock()
+
+
+def run_with_timeout(func, timeout, *args, **kwargs):
+
+    global _stage_pool, _stage_pool_pid
+
+    # Threads don't survive fork, so each process starts its own pool
+    with _stage_lock:
+        if _stage_pool_pid != os.getpid():
+            _stage_pool = ThreadPoolExecutor(max_workers=8)
+            _stage_pool_pid = os.getpid()
+
+    # A timed-out stage keeps running in its thread; its result is dropped
+    return _stage_pool.submit(func, *args, **kwargs).result(timeout=timeout)
+
+
+def build_filter(filters):
+    """Turn document/uploader/date filters into a Chroma where clause and shard list."""
+
+    if not filters or not any(filters.values()):
+        return None, None
+
+    records = get_pdf_records(
+        pdf_names=filters.get("pdf_names"),
+        uploaded_by=filters.get("uploaded_by"),
+        uploaded_after=filters.get("uploaded_after")
     )
-    
-    return local_llm
 
+    pdf_names = [record[0] for record in records]
 
-vector_store = retriever_function()
+    # Chunks record the saved file path as their source
+    sources = [os.path.join(UPLOAD_FOLDER, name) for name in pdf_names]
 
-local_llm = load_llm()
+    where = {"source": {"$in": sources}}
 
+    # Only the collections holding the matching documents need searching
+    if KB_SHARDING == "document":
+        shards = [shard_name(name) for name in pdf_names]
+    elif KB_SHARDING == "uploader":
+        shards = sorted({shard_name(uploaded_by or "unknown") for _, uploaded_by, _ in records})
+    else:
+        shards = None
 
-def similarity_search_with_score(question, k=3):
+    return where, shards
 
-    docs_with_scores = vector_store.similarity_search_with_score(question, k=k)
+
+def similarity_search_with_score(question, k=3, filters=None):
+
+    where, shards = build_filter(filters)
+
+    if where is not None and not where["source"]["$in"]:
+        return []
+
+    if shards is not None:
+        docs_with_scores = vector_store.similarity_search_with_score(question, k=k, filter=where, shards=shards)
+    else:
+        docs_with_scores = vector_store.similarity_search_with_score(question, k=k, filter=where)
 
     docs = []
 
@@ -64,6 +116,9 @@ def calculate_confidence(docs):
         for doc in docs
     ]
 
+    # Missing documents (e.g. a narrow filter) count as zero similarity
+    scores = (scores + [0, 0, 0])[:3]
+
     confidence = (
         0.6 * scores[0] +
         0.25 * scores[1] +
@@ -78,7 +133,18 @@ def format_docs(docs):
     if not docs:
         return "No relevant context found."
 
-    return "\n\n".join(doc.page_content for doc in docs)
+    return "\n\n".join(chunk_text(doc) for doc in docs)
+
+
+def chunk_text(doc):
+
+    # Chunks ingested with a chunk store keep only their hash in the vector store
+    chunk_hash = doc.metadata.get("chunk_hash")
+
+    if chunk_hash and chunk_store is not None:
+        return chunk_store.text(chunk_hash) or doc.page_content
+
+    return doc.page_content
 
 
 def extract_sources(docs):
@@ -97,9 +163,38 @@ def extract_sources(docs):
     return "\n".join(sources)
 
 
-def chat_pipeline():
+def remember_answer(answer, question, question_id, filters):
+
+    cache_id = generate_cache_id()
+
+    save_cache_to_chat_history(cache_id, question_id)
+
+    if not filters:
+        store_in_chroma(question, cache_id)
+
+    return {"answer": answer, "cache_id": cache_id}
+
 
-    prompt = ChatPromptTemplate.from_template(
+def finish_pending(future, result, question, question_id, filters):
+
+    try:
+        answer = future.result()
+    except Exception as e:
+        print(f"Background generation for question {question_id} failed: {e}")
+        update_final_answer(question_id, GENERATION_FAILED_MESSAGE, result["sources"], result["confidence"], None, None, None)
+        return
+
+    cache_id = generate_cache_id()
+
+    # The row holds the answer before the semantic cache can point at it
+    update_final_answer(question_id, answer, result["sources"], result["confidence"], cache_id, None, None)
+
+    if not filters:
+        store_in_chroma(question, cache_id)
+
+
+# Module level so warm-up builds the same prompts, and generation cache keys, as chat
+PROMPT = ChatPromptTemplate.from_template(
         """You are a QA Medical assistant. Use the following pieces of context to answer the question. If you don't know the answer, just say that "I don't know", don't try to make up an answer. Provide a summarized and well-formed answer in 2-4 sentences maximum, do not stop mid-sentence. Finish the response completely. 
 
         Context:
@@ -110,48 +205,35 @@ def chat_pipeline():
 
         Answer:""")
 
+
+def chat_pipeline():
+
     def process(inputs):
 
         question = inputs["question"]
         question_id = inputs["question_id"]
+        # The chat form always sends every filter; none set means the whole knowledge base
+        filters = inputs.get("filters")
+        filters = filters if filters and any(filters.values()) else None
+        session_id = inputs.get("session_id")
 
-        cache_id = search_cache(question)
-
-        if not cache_id:
-
-            docs = similarity_search_with_score(question)
-
-            context = format_docs(docs)
-            sources = extract_sources(docs)
-            confidence = calculate_confidence(docs)
-
-            formatted_prompt = prompt.format(
-                context=context,
-                question=question
-            )
-
-            answer = local_llm.invoke(formatted_prompt)
-
-            cache_id = generate_cache_id()
+        # Follow-ups ("what about in children?") are retrieved and answered as standalone questions
+        if session_id:
+            question = condense_question(question, recent_questions(session_id, question_id))
+            record_question(session_id, inputs["question"], question_id)
 
-            save_cache_to_chat_history(cache_id, question_id)
+        # Interactive requests get deadlines; bulk jobs (no flag) wait for the answer
+        interactive = inputs.get("interactive", False)
 
-            store_in_chroma(question, cache_id)
+        # Cached answers come from the whole corpus, so filtered questions skip the cache
+        cache_id = None if filters else search_cache(question)
 
-            return {
-                "answer": answer,
-                "sources": sources,
-                "confidence": confidence,
-                "cache_id": cache_id,
-                "accepted" : None,
-                "edited_answer" : None
-            }
-
-        else:
+        if cache_id:
 
             cached_answer = get_from_chat_history(cache_id)
 
-            if cached_answer:
+            # Rows still being completed in the background have no answer yet
+            if cached_answer and cached_answer["answer"] is not None:
 
                 return {
                     "answer": cached_answer["answer"],
@@ -160,7 +242,59 @@ def chat_pipeline():
                     "cache_id": cached_answer["cache_id"],
                     "accepted" : cached_answer["accepted"],
                     "edited_answer" : cached_answer["edited_answer"],
-                }               
+                }
+
+        result = {
+            "answer": None,
+            "sources": None,
+            "confidence": 0,
+            "cache_id": None,
+            "accepted" : None,
+            "edited_answer" : None
+        }
+
+        if interactive:
+            try:
+                docs = run_with_timeout(similarity_search_with_score, RETRIEVAL_TIMEOUT, question, filters=filters)
+            except FutureTimeout:
+                return {**result, "answer": RETRIEVAL_TIMEOUT_MESSAGE}
+        else:
+            docs = similarity_search_with_score(question, filters=filters)
+
+        context = format_docs(docs)
+
+        result["sources"] = extract_sources(docs)
+        result["confidence"] = calculate_confidence(docs)
+
+        formatted_prompt = PROMPT.format(
+            context=context,
+            question=question
+        )
+
+        if not interactive:
+            answer = generate(formatted_prompt, priority="bulk")
+            return {**result, **remember_answer(answer, question, question_id, filters)}
+
+        try:
+            future = submit_generation(formatted_prompt, user=inputs.get("user"))
+        except InferenceBusy:
+            return {**result, "answer": BUSY_MESSAGE}
+
+        try:
+            answer = future.result(timeout=GENERATION_TIMEOUT)
+        except FutureTimeout:
+
+            # Show the sources now and let the answer land in chat_history when it's done
+            update_final_answer(question_id, None, result["sources"], result["confidence"], None, None, None)
+
+            future.add_done_callback(
+                lambda done: finish_pending(done, result, question, question_id, filters)
+            )
+
+            return {**result, "pending": True}
+
+        return {**result, **remember_answer(answer, question, question_id, filters)}
+
     return RunnableLambda(process)
 
 
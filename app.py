@@ -1,20 +1,29 @@
+from dotenv import load_dotenv
+
+# Project modules read their settings at import time, so .env goes into the environment first
+load_dotenv()
+
 from flask import Flask, render_template, url_for, redirect, request, send_file, send_from_directory
 from flask_login import login_user, LoginManager, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, length, ValidationError
 from flask_bcrypt import Bcrypt
-from dotenv import load_dotenv
 import os
 from flask import jsonify
 
-from user_auth import  get_user_by_id, get_user_by_email, create_user, get_existing_user_email
+from user_auth import  get_user_by_id, get_user_credentials, create_user, get_existing_user_email
 from answer_generation import chat_pipeline
-from chat_history import update_history, get_user_history, accept_answer, edit_answer, get_global_history, update_final_answer
-from text_extraction import text_extraction, save_to_db
-from chunking_embedding import chunking, create_vector_store
-from upload_excell import extract_text_from_excell, excell_answer, save_answers_to_excel
+from chat_history import update_history, get_user_history, get_answer, queue_accept, queue_edit, get_global_history, update_final_answer, start_feedback_flusher
+from inference import is_saturated, queue_status, start_inference_servers
+from text_extraction import file_hash, save_to_db, get_pdf_records
+from chunking_embedding import retriever_function, chunk_store, document_embeddings
+from ingestion import ingest_pdf
+from index_maintenance import delete_document
+from upload_excell import get_excel_export
+from bulk_jobs import BULK_JOBS_PER_USER, count_running_jobs, create_job, get_user_jobs, start_job, start_job_monitor
 from sessions import rename_session_if_new, get_all_sessions, create_user_session
+from warmup import start_warmup
 
 #=========================================================================================================#
 
@@ -23,8 +32,6 @@ app = Flask(__name__)
 # Get project base directory
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-load_dotenv()
-
 # Set secret key for sessions/security
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
 
@@ -52,6 +59,10 @@ ANSWER_FOLDER = os.path.join(BASE_EXCELL_FOLDER)
 os.makedirs(QUESTION_FOLDER, exist_ok=True)
 os.makedirs(ANSWER_FOLDER, exist_ok=True)
 
+# Cached answer workbooks, one per session version
+EXPORT_FOLDER = os.path.join(ANSWER_FOLDER, "Excell_answers")
+os.makedirs(EXPORT_FOLDER, exist_ok=True)
+
 
 # Store folder paths in app config
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -61,6 +72,31 @@ app.config["ANSWER_FOLDER"] = ANSWER_FOLDER
 # Initialize RAG pipeline
 rag_chain = chat_pipeline()
 
+# The model runs in its own processes, forked here before gunicorn forks the web workers.
+# Under the debug reloader only the child that serves requests starts them
+if __name__ != "__main__" or os.getenv("WERKZEUG_RUN_MAIN") == "true":
+    start_inference_servers()
+
+# Vector store that new PDFs are ingested into
+knowledge_base = retriever_function()
+
+
+def start_background_tasks():
+    
+    # Resume bulk Excel runs interrupted by a restart
+    start_job_monitor(rag_chain)
+    
+    # Write approvals and edits to the database in coalesced batches
+    start_feedback_flusher()
+    
+    # Warm the embedding model and indexes, touch index files and refill caches so the first users don't pay for it
+    start_warmup()
+
+
+# Under gunicorn these start in each worker after fork instead (see gunicorn.conf.py)
+if os.getenv("DEFER_BACKGROUND_TASKS") != "1":
+    start_background_tasks()
+
 
 ###======================================= Load user for Flask-Login  ========================================###
 
@@ -144,10 +180,10 @@ def login():
         email = request.form['email']
         password = request.form['password']
         
-        user = get_user_by_email(email)
+        user, password_hash = get_user_credentials(email)
         
         if user:
-            if bcrypt.check_password_hash(user.password, password):
+            if bcrypt.check_password_hash(password_hash, password):
                 
                 login_user(user)
                 
@@ -213,18 +249,22 @@ def upload_pdf():
     file_path = os.path.join(UPLOAD_FOLDER, file.filename)
     file.save(file_path)
 
-    # Extract text from PDF
-    pdf_name, docs = text_extraction(file_path)
+    pdf_name = os.path.basename(file_path)
     
-    # Save extracted data to database
-    status = save_to_db(pdf_name, docs)
+    # Register the PDF by its file hash; pages are only extracted once, by ingest_pdf
+    status = save_to_db(pdf_name, file_hash(file_path))
 
-     # If new PDF, process and store vectors
+     # If new PDF, chunk and embed it page by page
     if status == "already_exists":
         pass
     else:
-        chunks = chunking(docs)
-        create_vector_store(chunks)
+        ingest_pdf(
+            file_path,
+            knowledge_base,
+            extra_metadata={"pdf_name": pdf_name, "uploaded_by": current_user.email},
+            chunk_store=chunk_store,
+            embeddings=document_embeddings
+        )
 
     return render_template("upload_questions.html")
 
@@ -244,10 +284,23 @@ def chat_directly():
     # Get all chat sessions
     chat_sessions = get_all_sessions("chat")
     
+    # Set when this worker, or this user, already has the maximum answers in flight
+    busy = False
     
-    if request.method == "POST":
+    if request.method == "POST" and is_saturated(email):
+        busy = True
+    
+    elif request.method == "POST":
 
         question = request.form.get("question")
+        
+        # Optional restriction of retrieval to part of the knowledge base
+        pdf_name = request.form.get("pdf_name")
+        filters = {
+            "pdf_names": [pdf_name] if pdf_name else None,
+            "uploaded_by": request.form.get("uploaded_by") or None,
+            "uploaded_after": request.form.get("uploaded_after") or None,
+        }
 
         if question:
             
@@ -275,20 +328,25 @@ def chat_directly():
             # Get answer from RAG model
             answer = rag_chain.invoke({
                 "question": question,
-                "question_id": question_id
+                "question_id": question_id,
+                "session_id": session_id,
+                "filters": filters,
+                "interactive": True,
+                "user": email
             })
 
 
-            # Update database with final answer
-            update_final_answer(
-                question_id,
-                answer["answer"],
-                answer["sources"],
-                answer["confidence"],
-                answer["cache_id"],
-                answer["accepted"],
-                answer["edited_answer"]
-            )
+            # Pending answers are written by the background generation
+            if not answer.get("pending"):
+                update_final_answer(
+                    question_id,
+                    answer["answer"],
+                    answer["sources"],
+                    answer["confidence"],
+                    answer["cache_id"],
+                    answer["accepted"],
+                    answer["edited_answer"]
+                )
 
     
     # Get chat history if session exists
@@ -313,6 +371,12 @@ def chat_directly():
         display_answer = entry['edited_answer'] if entry['edited_answer'] is not None else entry['answer']
         display_confidence = entry['confidence']
         
+        # Generation is still running in the background
+        pending = display_answer is None
+        
+        if pending:
+            display_answer = "Generating the answer... this page updates when it is ready."
+        
         messages.append({
             "text": f"""Answer:
                         {display_answer}
@@ -333,10 +397,43 @@ def chat_directly():
                         
                         "original_answer": entry['answer'],
                         
-                        "sources": entry['sources']  # ADDED
+                        "sources": entry['sources'],  # ADDED
+                        
+                        "pending": pending
         })
 
-    return render_template("chat.html", messages=messages, chat_sessions= chat_sessions, active_session=session_id)
+    # Options for the knowledge base filter
+    pdf_records = get_pdf_records()
+    
+    return render_template(
+        "chat.html",
+        messages=messages,
+        chat_sessions= chat_sessions,
+        active_session=session_id,
+        busy=busy,
+        pdf_names=[record[0] for record in pdf_records],
+        uploaders=sorted({record[1] for record in pdf_records if record[1]})
+    ), 503 if busy else 200
+
+
+###=====================================  Route to poll a pending answer  =====================================###
+
+
+@app.route('/answer_status/<int:question_id>')
+@login_required
+def answer_status(question_id):
+
+    return jsonify({"ready": get_answer(question_id) is not None})
+
+
+###====================================  Route to show the generation queue  ===================================###
+
+
+@app.route('/queue_status')
+@login_required
+def queue_status_route():
+
+    return jsonify({"inference": queue_status(), "jobs": get_user_jobs(current_user.email)})
 
 ###=======================================  Route to accept answer  ===========================================###
 
@@ -345,7 +442,7 @@ def accept_answer_route(question_id):
     
     try:
         
-        accept_answer(question_id)
+        queue_accept(question_id)
         return jsonify({"success": True})
     
     except Exception as e:
@@ -371,8 +468,8 @@ def edit_answer_route(question_id):
         if not new_answer or not session_id:
             return jsonify({"success": False}), 400
 
-        # Update answer in database
-        edit_answer(question_id, new_answer)
+        # Queue the edit; it is written in the next batch
+        queue_edit(question_id, new_answer)
 
         return jsonify({"success": True})
 
@@ -436,30 +533,42 @@ def upload_excell():
             return "No file uploaded", 400
 
 
-        # Get the file and save it to question folder
+        # Bulk runs share the model with chat, so each user gets BULK_JOBS_PER_USER at a time
+        if count_running_jobs(email) >= BULK_JOBS_PER_USER:
+            return "An Excel file is still being processed, please wait for it to finish", 429
+
+
+        # Get the file and save it to question folder, kept per session so the job can resume from it
         excell_file = request.files["excell_file"]
 
-        file_path = os.path.join(QUESTION_FOLDER, excell_file.filename)
+        file_path = os.path.join(QUESTION_FOLDER, f"{session_id}_{excell_file.filename}")
         excell_file.save(file_path)
 
         
-        # Extract questions from Excel
-        questions_list = extract_text_from_excell(file_path)
+        # Track the run as a job so it can resume after a restart
+        job_id = create_job(session_id, email, file_path)
 
         
-         # Generate answers using RAG
-        final_answer = excell_answer(
-            questions_list,
-            session_id,
-            email,
-            rag_chain
+        def rename_session(final_answer):
+            if final_answer:
+                rename_session_if_new(session_id, final_answer[0]["question"])
+
+
+         # Answer in the background at bulk priority; the page polls /queue_status for progress
+        start_job(
+            {
+                "job_id": job_id,
+                "session_id": session_id,
+                "email": email,
+                "file_path": file_path,
+                "last_sheet": None,
+                "last_row": None,
+            },
+            rag_chain,
+            on_done=rename_session
         )
 
 
-        if final_answer:
-            rename_session_if_new(session_id, final_answer[0]["question"])
-
-
         return redirect(
             url_for("upload_excell", session_id=session_id, file=answer_file)
         )
@@ -468,9 +577,11 @@ def upload_excell():
     # Load history and output file if session exists
     if session_id:
         history = get_user_history(session_id)
-        answer_file = f"EXCELL/Excell_answers/rag_answers_{session_id}.xlsx"
+        answer_file = url_for("download_excel", session_id=session_id)
+        processing = any(job["session_id"] == session_id for job in get_user_jobs(email))
     else:
         history = []
+        processing = False
 
 
     return render_template(
@@ -478,7 +589,8 @@ def upload_excell():
         chat_sessions=chat_sessions,
         active_session=session_id,
         history=history,
-        excel_file = answer_file
+        excel_file = answer_file,
+        processing = processing
     )
 
 
@@ -489,14 +601,14 @@ def upload_excell():
 @login_required
 def download_excel(session_id):
 
-    history = get_user_history(session_id)
-
-    file_path = f"EXCELL/Excell_answers/rag_answers_{session_id}.xlsx"
+    # Reuses the last export unless the session changed since
+    file_path = get_excel_export(session_id, EXPORT_FOLDER)
 
-    # Save answers to Excel file
-    save_answers_to_excel(history, file_path)
-
-    return send_file(file_path, as_attachment=True)
+    return send_file(
+        file_path,
+        as_attachment=True,
+        download_name=f"rag_answers_{session_id}.xlsx"
+    )
 
 
 ###=======================================  Approve an Excel answer  ==========================================###
@@ -511,8 +623,8 @@ def excel_accept():
     if not question_id:
         return {"status": "error"}, 400
 
-     # Mark answer as accepted in database
-    accept_answer(question_id)
+     # Queue the approval; it is written in the next batch
+    queue_accept(question_id)
 
     return {"status": "success"}
 
@@ -530,8 +642,8 @@ def excel_edit():
     if not question_id or not new_answer:
         return {"status": "error"}, 400
 
-    # Update answer in database
-    edit_answer(question_id, new_answer)
+    # Queue the edit; it is written in the next batch
+    queue_edit(question_id, new_answer)
 
     return jsonify({"status": "success"})
 
@@ -557,6 +669,19 @@ def serve_pdf(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
 
 
+###=========================================  Delete PDF Route  =============================================###
+
+
+@app.route("/pdfs/<filename>/delete", methods=["POST"])
+@login_required
+def delete_pdf(filename):
+    
+    # Removes the chunks, the pdf_main row, cached answers citing the PDF and the file
+    delete_document(knowledge_base, filename)
+    
+    return redirect(url_for("list_pdfs"))
+
+
 ###=========================================  Global History Route  ===========================================###
 
 
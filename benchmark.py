@@ -0,0 +1,502 @@
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+SAMPLE_PROMPTS = [
+    """Context:
+Hypertension is defined as a systolic blood pressure of 130 mmHg or higher, or a diastolic blood pressure of 80 mmHg or higher. First-line treatment includes thiazide diuretics, ACE inhibitors, ARBs and calcium channel blockers.
+
+Question:
+What are the first-line treatments for hypertension?
+
+Answer:""",
+    """Context:
+Type 2 diabetes is diagnosed when fasting plasma glucose is 126 mg/dL or higher, or HbA1c is 6.5% or higher. Metformin remains the preferred initial pharmacologic agent.
+
+Question:
+Which drug is preferred initially for type 2 diabetes?
+
+Answer:""",
+]
+
+
+###=========================================  Generation benchmark  ==========================================###
+
+
+def run_generation(prompts, draft_mode):
+
+    from inference import load_llm
+
+    # Greedy decoding so both modes can be compared for equivalence
+    llm = load_llm(draft_mode=draft_mode, temperature=0)
+
+    answers = []
+    tokens = 0
+
+    start = time.perf_counter()
+
+    for prompt in prompts:
+        answer = llm.invoke(prompt)
+        answers.append(answer)
+        tokens += llm.get_num_tokens(answer)
+
+    elapsed = time.perf_counter() - start
+
+    return answers, tokens / elapsed
+
+
+def benchmark_generation(args):
+
+    baseline, baseline_tps = run_generation(SAMPLE_PROMPTS, "none")
+    draft, draft_tps = run_generation(SAMPLE_PROMPTS, args.draft_mode)
+
+    same = sum(a.strip() == b.strip() for a, b in zip(baseline, draft))
+
+    print(f"baseline          : {baseline_tps:.2f} tokens/sec")
+    print(f"{args.draft_mode:<18}: {draft_tps:.2f} tokens/sec")
+    print(f"speedup           : {draft_tps / baseline_tps:.2f}x")
+    print(f"identical answers : {same}/{len(SAMPLE_PROMPTS)}")
+
+
+###==========================================  Embedding benchmark  ==========================================###
+
+
+SAMPLE_TEXTS = [
+    "What is the first-line treatment for hypertension?",
+    "Metformin remains the preferred initial pharmacologic agent for type 2 diabetes.",
+    "Beta-blockers reduce mortality after myocardial infarction.",
+    "Which antibiotics are recommended for community-acquired pneumonia in children?",
+] * 16
+
+
+def peak_rss_mb():
+
+    import resource
+
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_queries(model, texts):
+
+    start = time.perf_counter()
+
+    for text in texts:
+        model.embed_query(text)
+
+    return (time.perf_counter() - start) / len(texts) * 1000
+
+
+def benchmark_embedding(args):
+
+    import numpy as np
+
+    from chunking_embedding import load_embedding_model
+    from model_config import embedding_config
+
+    config = embedding_config()
+
+    reference = load_embedding_model({**config, "backend": "torch", "batch_window_ms": 0})
+    reference_vectors = np.array(reference.embed_documents(SAMPLE_TEXTS))
+    del reference
+
+    rss_before = peak_rss_mb()
+
+    candidate = load_embedding_model(config)
+
+    start = time.perf_counter()
+    candidate_vectors = np.array(candidate.embed_documents(SAMPLE_TEXTS))
+    ingest_rate = len(SAMPLE_TEXTS) / (time.perf_counter() - start)
+
+    query_ms = time_queries(candidate, SAMPLE_TEXTS[:args.queries])
+
+    reference_vectors /= np.linalg.norm(reference_vectors, axis=1, keepdims=True)
+    candidate_vectors /= np.linalg.norm(candidate_vectors, axis=1, keepdims=True)
+    cosine = (reference_vectors * candidate_vectors).sum(axis=1)
+
+    print(f"backend            : {config['backend']}")
+    print(f"ingestion          : {ingest_rate:.1f} texts/sec")
+    print(f"query latency      : {query_ms:.2f} ms")
+    print(f"peak RSS growth    : {peak_rss_mb() - rss_before:.1f} MB")
+    print(f"parity (cosine)    : min {cosine.min():.4f}, mean {cosine.mean():.4f}")
+
+    if cosine.min() < args.min_cosine:
+        raise SystemExit(f"Parity check failed: cosine below {args.min_cosine}")
+
+
+###===========================================  Cleaning benchmark  ==========================================###
+
+
+def legacy_clean_extraction(text):
+
+    import re
+
+    text = re.sub(r'-\s+', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def load_pages(pdf_path, synthetic_pages):
+
+    if pdf_path:
+
+        import fitz
+
+        with fitz.open(pdf_path) as pdf:
+            return [page.get_text() for page in pdf]
+
+    page = (
+        "Hypertension is a major risk factor for cardiovascular dis-\nease. Beta-\n"
+        "blockers and ACE inhibitors are ﬁrst-line   options;\n\n  dose adjust-\n"
+        "ment is needed in renal impairment.  \n"
+    ) * 40
+
+    return [page] * synthetic_pages
+
+
+def time_cleaning(func, pages, repeat):
+
+    start = time.perf_counter()
+
+    for _ in range(repeat):
+        for page in pages:
+            func(page)
+
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_cleaning(args):
+
+    from text_extraction import clean_extraction
+
+    pages = load_pages(args.pdf, args.pages)
+    size_mb = sum(len(page) for page in pages) / 1e6
+
+    legacy = time_cleaning(legacy_clean_extraction, pages, args.repeat)
+    current = time_cleaning(clean_extraction, pages, args.repeat)
+
+    print(f"corpus            : {len(pages)} pages, {size_mb:.1f} MB")
+    print(f"legacy two-pass   : {legacy * 1000:.1f} ms ({size_mb / legacy:.1f} MB/s)")
+    print(f"clean_extraction  : {current * 1000:.1f} ms ({size_mb / current:.1f} MB/s)")
+    print(f"speedup           : {legacy / current:.2f}x")
+
+
+###==========================================  Compaction benchmark  =========================================###
+
+
+def time_collection_queries(collection, queries, k):
+
+    start = time.perf_counter()
+
+    for query in queries:
+        collection.query(query_embeddings=[query], n_results=k)
+
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+
+def benchmark_compaction(args):
+
+    import shutil
+    import tempfile
+
+    import chromadb
+    import numpy as np
+
+    from index_maintenance import CHROMA_COLLECTION, CHROMA_PERSIST_DIR, compact_collection
+
+    # Work on a copy so the live index is never touched
+    workdir = tempfile.mkdtemp()
+    copy_dir = os.path.join(workdir, "index")
+    shutil.copytree(CHROMA_PERSIST_DIR, copy_dir)
+
+    try:
+
+        client = chromadb.PersistentClient(path=copy_dir)
+        collection = client.get_collection(args.collection or CHROMA_COLLECTION)
+
+        # Stored vectors make realistic queries
+        sample = collection.get(limit=args.queries, include=["embeddings"])["embeddings"]
+        queries = [np.asarray(vector).tolist() for vector in sample]
+
+        before = time_collection_queries(collection, queries, args.k)
+
+        compact_collection(client, collection.name, args.m, args.ef_construction, args.ef_search)
+        collection = client.get_collection(collection.name)
+
+        after = time_collection_queries(collection, queries, args.k)
+
+        # The client's files are gone after cleanup
+        count = collection.count()
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"vectors           : {count}")
+    print(f"before compaction : {before:.2f} ms/query")
+    print(f"after compaction  : {after:.2f} ms/query")
+
+
+###========================================  Vector backend benchmark  =======================================###
+
+
+def synthetic_vectors(n, dim, seed=0):
+
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def benchmark_vectors(args):
+
+    import shutil
+    import tempfile
+
+    import chromadb
+    import numpy as np
+
+    from numpy_store import NumpyVectorStore
+
+    for size in args.sizes:
+
+        workdir = tempfile.mkdtemp()
+
+        try:
+
+            vectors = synthetic_vectors(size, args.dim)
+
+            # Queries near stored vectors, like paraphrased questions
+            queries = vectors[:args.queries] + 0.05 * synthetic_vectors(args.queries, args.dim, seed=1)
+            queries = NumpyVectorStore.normalize(queries)
+
+            store = NumpyVectorStore(None, os.path.join(workdir, "numpy"), dtype=args.dtype)
+            ids = [str(i) for i in range(size)]
+
+            start = time.perf_counter()
+            for i in range(0, size, 5000):
+                store.add_embeddings(vectors[i:i + 5000], [""] * len(ids[i:i + 5000]), ids=ids[i:i + 5000])
+            numpy_build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            exact = [[row for row, _ in store.search_vectors(query, args.k)[0]] for query in queries]
+            numpy_single = (time.perf_counter() - start) / len(queries) * 1000
+
+            start = time.perf_counter()
+            store.search_vectors(queries, args.k)
+            numpy_batch = (time.perf_counter() - start) / len(queries) * 1000
+
+            client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+            collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+
+            start = time.perf_counter()
+            for i in range(0, size, 5000):
+                collection.add(ids=ids[i:i + 5000], embeddings=vectors[i:i + 5000].tolist())
+            chroma_build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            approx = [
+                [int(id_) for id_ in collection.query(query_embeddings=[query.tolist()], n_results=args.k)["ids"][0]]
+                for query in queries
+            ]
+            chroma_single = (time.perf_counter() - start) / len(queries) * 1000
+
+            start = time.perf_counter()
+            collection.query(query_embeddings=queries.tolist(), n_results=args.k)
+            chroma_batch = (time.perf_counter() - start) / len(queries) * 1000
+
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)])
+
+        print(f"--- {size} vectors ({args.dim}d, numpy {args.dtype}) ---")
+        print(f"build             : numpy {numpy_build:.1f} s, chroma {chroma_build:.1f} s")
+        print(f"single query      : numpy {numpy_single:.2f} ms, chroma {chroma_single:.2f} ms")
+        print(f"batched query     : numpy {numpy_batch:.2f} ms/query, chroma {chroma_batch:.2f} ms/query")
+        print(f"chroma recall@{args.k}   : {recall:.3f} (numpy is exact)")
+
+
+###==========================================  Chunking benchmark  ===========================================###
+
+
+def benchmark_chunking(args):
+
+    import fitz
+    import numpy as np
+    from transformers import AutoTokenizer
+
+    import ingestion
+    from model_config import embedding_config
+
+    config = embedding_config()
+    tokenizer = AutoTokenizer.from_pretrained(config["model_name"])
+
+    print(f"pdf               : {args.pdf}")
+
+    for chunker in ("recursive", "structure"):
+
+        ingestion._init_worker(config["model_name"], args.chunk_size, args.chunk_overlap, chunker, args.tables)
+
+        if chunker == "recursive":
+            ingestion._chunker = None
+
+        with fitz.open(args.pdf) as pdf:
+            pages = pdf.page_count
+
+        start = time.perf_counter()
+        chunks = [chunk for n in range(pages) for chunk in ingestion._chunk_page((args.pdf, n))[1]]
+        elapsed = time.perf_counter() - start
+
+        counts = [len(ids) for ids in tokenizer([c.page_content for c in chunks], add_special_tokens=False)["input_ids"]]
+        sections = len({c.metadata.get("section") for c in chunks} - {None})
+
+        print(
+            f"{chunker:<18}: {pages / elapsed:.1f} pages/s, {sum(counts) / elapsed:.0f} tokens/s, "
+            f"{len(chunks)} chunks, {np.mean(counts):.0f} tokens/chunk, {sections} sections"
+        )
+
+
+###=========================================  Compression benchmark  ========================================###
+
+
+def load_collection_vectors(name, limit):
+
+    import numpy as np
+
+    from index_maintenance import COPY_BATCH, chroma_client
+
+    collection = chroma_client().get_collection(name)
+    vectors = []
+
+    while len(vectors) < limit:
+
+        batch = collection.get(limit=min(COPY_BATCH, limit - len(vectors)), offset=len(vectors), include=["embeddings"])
+
+        if not batch["ids"]:
+            break
+
+        vectors.extend(batch["embeddings"])
+
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def benchmark_compression(args):
+
+    import shutil
+    import tempfile
+
+    import numpy as np
+
+    from numpy_store import NumpyVectorStore
+
+    if args.collection:
+        vectors = NumpyVectorStore.normalize(load_collection_vectors(args.collection, args.size))
+    else:
+        vectors = synthetic_vectors(args.size, args.dim)
+
+    queries = vectors[:args.queries] + 0.05 * synthetic_vectors(args.queries, vectors.shape[1], seed=1)
+
+    workdir = tempfile.mkdtemp()
+
+    try:
+
+        stores = {}
+
+        for dtype in ("float32", "float16", "int8"):
+            stores[dtype] = NumpyVectorStore(None, os.path.join(workdir, dtype), dtype=dtype)
+            stores[dtype].add_embeddings(vectors, [""] * len(vectors))
+
+        exact = [[row for row, _ in hits] for hits in stores["float32"].search_vectors(queries, args.k)]
+
+        print(f"corpus            : {len(vectors)} vectors, {vectors.shape[1]}d")
+
+        for dtype, rescore in (("float32", False), ("float16", False), ("int8", False), ("int8", True)):
+
+            store = stores[dtype]
+
+            start = time.perf_counter()
+            results = store.search_vectors(queries, args.k, rescore=rescore)
+            latency = (time.perf_counter() - start) / len(queries) * 1000
+
+            recall = np.mean([
+                len({row for row, _ in hits} & set(truth)) / len(truth)
+                for hits, truth in zip(results, exact)
+            ])
+
+            scanned_mb = store._matrix.nbytes / 1e6
+            label = f"{dtype}{' + rescore' if rescore else ''}"
+
+            print(f"{label:<18}: scanned {scanned_mb:.1f} MB, recall@{args.k} {recall:.3f}, {latency:.2f} ms/query")
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+###=================================================  CLI  ===================================================###
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="SAGE performance benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generation = subparsers.add_parser("generation", help="Compare decoding modes")
+    generation.add_argument("--draft-mode", default="prompt_lookup")
+    generation.set_defaults(func=benchmark_generation)
+
+    embedding = subparsers.add_parser("embedding", help="Check embedding backend parity and speed")
+    embedding.add_argument("--queries", type=int, default=32)
+    embedding.add_argument("--min-cosine", type=float, default=0.99)
+    embedding.set_defaults(func=benchmark_embedding)
+
+    cleaning = subparsers.add_parser("cleaning", help="Time PDF text cleaning")
+    cleaning.add_argument("--pdf", help="PDF to use instead of a synthetic corpus")
+    cleaning.add_argument("--pages", type=int, default=2000)
+    cleaning.add_argument("--repeat", type=int, default=3)
+    cleaning.set_defaults(func=benchmark_cleaning)
+
+    compaction = subparsers.add_parser("compaction", help="Query latency before/after compaction")
+    compaction.add_argument("--collection")
+    compaction.add_argument("--queries", type=int, default=200)
+    compaction.add_argument("--k", type=int, default=3)
+    compaction.add_argument("--m", type=int, default=16)
+    compaction.add_argument("--ef-construction", type=int, default=100)
+    compaction.add_argument("--ef-search", type=int, default=100)
+    compaction.set_defaults(func=benchmark_compaction)
+
+    vectors = subparsers.add_parser("vectors", help="NumPy exact search vs Chroma HNSW")
+    vectors.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    vectors.add_argument("--dim", type=int, default=384)
+    vectors.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    vectors.add_argument("--queries", type=int, default=100)
+    vectors.add_argument("--k", type=int, default=3)
+    vectors.set_defaults(func=benchmark_vectors)
+
+    chunking = subparsers.add_parser("chunking", help="Recursive vs structure-aware chunking throughput")
+    chunking.add_argument("--pdf", required=True)
+    chunking.add_argument("--chunk-size", type=int, default=500)
+    chunking.add_argument("--chunk-overlap", type=int, default=50)
+    chunking.add_argument("--tables", action="store_true")
+    chunking.set_defaults(func=benchmark_chunking)
+
+    compression = subparsers.add_parser("compression", help="Recall and size of float16/int8 indexes")
+    compression.add_argument("--collection", help="Use stored embeddings instead of synthetic vectors")
+    compression.add_argument("--size", type=int, default=100_000)
+    compression.add_argument("--dim", type=int, default=384)
+    compression.add_argument("--queries", type=int, default=200)
+    compression.add_argument("--k", type=int, default=10)
+    compression.set_defaults(func=benchmark_compression)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
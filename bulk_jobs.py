@@ -0,0 +1,361 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from user_auth import get_db_connection
+
+
+# A running job whose checkpoint hasn't moved for this long is treated as interrupted
+BULK_JOB_STALE_SECONDS = int(os.getenv("BULK_JOB_STALE_SECONDS", "600"))
+BULK_JOB_RESUME_INTERVAL = int(os.getenv("BULK_JOB_RESUME_INTERVAL", "60"))
+
+# A live job bumps updated_at this often, even while it waits for an inference slot
+BULK_JOB_HEARTBEAT_SECONDS = int(os.getenv("BULK_JOB_HEARTBEAT_SECONDS", "60"))
+
+# Runs of a job that may fail before it is given up; failed runs are retried after BULK_JOB_RETRY_DELAY
+BULK_JOB_ATTEMPTS = int(os.getenv("BULK_JOB_ATTEMPTS", "3"))
+BULK_JOB_RETRY_DELAY = int(os.getenv("BULK_JOB_RETRY_DELAY", "60"))
+
+# Bulk runs a user may have going at once
+BULK_JOBS_PER_USER = int(os.getenv("BULK_JOBS_PER_USER", "1"))
+
+
+def create_job(session_id, email, file_path):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO bulk_jobs (session_id, user_email, file_path, status, updated_at)
+            OUTPUT INSERTED.job_id
+            VALUES (?, ?, ?, 'running', SYSDATETIME())
+        """, (session_id, email, file_path))
+
+        job_id = cursor.fetchone()[0]
+        conn.commit()
+
+        return job_id
+
+
+def add_job_question(job_id, email, session_id, question, sheet, row):
+
+    # The history row and the checkpoint are committed together, so a crash
+    # can never leave a question both pending and unread
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            INSERT INTO chat_history (user_email, session_id, question)
+            OUTPUT INSERTED.question_id
+            VALUES (?, ?, ?)
+        """, (email, session_id, question))
+
+        question_id = cursor.fetchone()[0]
+
+        cursor.execute("""
+            UPDATE bulk_jobs
+            SET last_sheet = ?, last_row = ?, updated_at = SYSDATETIME()
+            WHERE job_id = ?
+        """, (sheet, row, job_id))
+
+        conn.commit()
+
+        return question_id
+
+
+def touch_job(job_id):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE bulk_jobs
+            SET updated_at = SYSDATETIME()
+            WHERE job_id = ?
+        """, (job_id,))
+
+        conn.commit()
+
+
+def finish_job(job_id, status="completed"):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE bulk_jobs
+            SET status = ?, updated_at = SYSDATETIME()
+            WHERE job_id = ?
+        """, (status, job_id))
+
+        conn.commit()
+
+
+def fail_job(job_id):
+
+    # Leaves the job running but stale after BULK_JOB_RETRY_DELAY, so the monitor retries it
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE bulk_jobs
+            SET attempts = attempts + 1,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'running' END,
+                updated_at = DATEADD(second, ?, SYSDATETIME())
+            OUTPUT INSERTED.status
+            WHERE job_id = ?
+        """, (BULK_JOB_ATTEMPTS, BULK_JOB_RETRY_DELAY - BULK_JOB_STALE_SECONDS, job_id))
+
+        row = cursor.fetchone()
+        conn.commit()
+
+        return row[0] if row else None
+
+
+def count_running_jobs(email):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM bulk_jobs
+            WHERE user_email = ? AND status = 'running'
+        """, (email,))
+
+        return cursor.fetchone()[0]
+
+
+def get_user_jobs(email):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT j.job_id, j.session_id, j.status, j.updated_at,
+                   (SELECT COUNT(*) FROM chat_history h WHERE h.session_id = j.session_id) AS questions,
+                   (SELECT COUNT(*) FROM chat_history h WHERE h.session_id = j.session_id AND h.answer IS NOT NULL) AS answered
+            FROM bulk_jobs j
+            WHERE j.user_email = ? AND j.status = 'running'
+            ORDER BY j.job_id
+        """, (email,))
+
+        return [
+            {
+                "job_id": row[0],
+                "session_id": row[1],
+                "status": row[2],
+                "updated_at": row[3].isoformat() if row[3] else None,
+                "questions": row[4],
+                "answered": row[5],
+            }
+            for row in cursor.fetchall()
+        ]
+
+
+def get_pending_questions(session_id):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT question_id, question
+            FROM chat_history
+            WHERE session_id = ? AND answer IS NULL
+            ORDER BY question_id
+        """, (session_id,))
+
+        return cursor.fetchall()
+
+
+def get_job(job_id):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT status, last_sheet, last_row
+            FROM bulk_jobs
+            WHERE job_id = ?
+        """, (job_id,))
+
+        row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return {"status": row[0], "last_sheet": row[1], "last_row": row[2]}
+
+
+def claim_stale_job():
+
+    # Bumping updated_at claims the job, so only one worker resumes it. One job at a
+    # time: a claimed job only stays fresh while its own run heartbeats it
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE TOP (1) bulk_jobs
+            SET updated_at = SYSDATETIME()
+            OUTPUT INSERTED.job_id, INSERTED.session_id, INSERTED.user_email,
+                   INSERTED.file_path, INSERTED.last_sheet, INSERTED.last_row
+            WHERE status = 'running'
+              AND updated_at < DATEADD(second, -?, SYSDATETIME())
+        """, (BULK_JOB_STALE_SECONDS,))
+
+        row = cursor.fetchone()
+        conn.commit()
+
+        if row is None:
+            return None
+
+        return {
+            "job_id": row[0],
+            "session_id": row[1],
+            "email": row[2],
+            "file_path": row[3],
+            "last_sheet": row[4],
+            "last_row": row[5],
+        }
+
+
+def skip_to_checkpoint(questions, last_sheet, last_row):
+
+    # Sheets and rows are read in a fixed order, so everything up to the checkpoint was already queued
+    if last_row is None:
+        yield from questions
+        return
+
+    reached = False
+
+    for item in questions:
+
+        if reached:
+            yield item
+        elif item["sheet"] == last_sheet and item["row"] == last_row:
+            reached = True
+
+
+@contextmanager
+def heartbeat(job_id):
+
+    # Without it a run waiting on bulk priority looks stale and a second worker resumes it
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(BULK_JOB_HEARTBEAT_SECONDS):
+            try:
+                touch_job(job_id)
+            except Exception as e:
+                print(f"Heartbeat for bulk job {job_id} failed: {e}")
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job, rag_chain):
+
+    # Imported here because upload_excell depends on this module
+    from upload_excell import iter_questions, excell_answer, answer_pending
+
+    try:
+
+        with heartbeat(job["job_id"]):
+
+            # The job may have finished or failed, or moved its checkpoint, since it was claimed
+            current = get_job(job["job_id"])
+
+            if current is None or current["status"] != "running":
+                return None
+
+            # Questions that were read but never answered
+            answer_pending(get_pending_questions(job["session_id"]), rag_chain, job["job_id"])
+
+            remaining = skip_to_checkpoint(
+                iter_questions(job["file_path"]),
+                current["last_sheet"],
+                current["last_row"]
+            )
+
+            results = excell_answer(remaining, job["session_id"], job["email"], rag_chain, job_id=job["job_id"])
+
+    except Exception as e:
+
+        # Transient DB or model errors are retried from the checkpoint by the monitor
+        status = fail_job(job["job_id"])
+        print(f"Bulk job {job['job_id']} failed: {e}" + (", will retry" if status == "running" else ""))
+        raise
+
+    finish_job(job["job_id"])
+
+    return results
+
+
+def start_job(job, rag_chain, on_done=None):
+
+    # Runs outside the request; if the process dies the monitor resumes the job
+    def worker():
+
+        try:
+            results = run_job(job, rag_chain)
+        except Exception:
+            return
+
+        if on_done:
+            on_done(results)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    return thread
+
+
+def resume_stale_jobs(rag_chain):
+
+    while True:
+
+        job = claim_stale_job()
+
+        if job is None:
+            return
+
+        print(f"Resuming bulk job {job['job_id']} for session {job['session_id']}")
+
+        # A failure is recorded by run_job; carry on with the other jobs
+        try:
+            run_job(job, rag_chain)
+        except Exception:
+            continue
+
+
+def start_job_monitor(rag_chain):
+
+    def monitor():
+        while True:
+            try:
+                resume_stale_jobs(rag_chain)
+            except Exception as e:
+                print(f"Error resuming bulk jobs: {e}")
+            time.sleep(BULK_JOB_RESUME_INTERVAL)
+
+    thread = threading.Thread(target=monitor, daemon=True)
+    thread.start()
+
+    return thread
@@ -1,5 +1,9 @@
 from flask import session
 from user_auth import get_db_connection
+import atexit
+import os
+import threading
+import time
 
 
 def update_history(email, session_id, question, answer, sources, confidence, cache_id, accepted, edited_answer):
@@ -57,8 +61,43 @@ def update_final_answer(question_id, answer, sources, confidence, cache_id, acce
             conn.commit()
 
     
+def get_answer(question_id):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT answer
+            FROM chat_history
+            WHERE question_id = ?
+        """, (question_id,))
+
+        row = cursor.fetchone()
+
+        return row[0] if row else None
+
+
+def get_last_question_id(session_id, before_question_id):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT MAX(question_id)
+            FROM chat_history
+            WHERE session_id = ? AND question_id < ?
+        """, (session_id, before_question_id))
+
+        return cursor.fetchone()[0]
+
+
 def get_user_history(session_id):
 
+    # Write queued approvals/edits first so the page reflects them
+    flush_feedback()
+
     with get_db_connection() as conn:
 
         cursor = conn.cursor()
@@ -86,44 +125,170 @@ def get_user_history(session_id):
         return history
 
 
-def accept_answer(question_id):
-    
+def iter_user_history(session_id):
+
+    flush_feedback()
+
+    # Rows are fetched from the cursor as they are consumed
     with get_db_connection() as conn:
 
         cursor = conn.cursor()
-        
+
         cursor.execute("""
-            UPDATE chat_history
-            SET accepted = 1
-            WHERE cache_id = (
-                SELECT cache_id
-                FROM chat_history
-                WHERE question_id = ?
-            )
-        """, (question_id,))
-        
-        conn.commit()
-    
-    
-def edit_answer(question_id, new_answer):
-    
+            SELECT question_id, question, answer, confidence, sources, accepted, edited_answer
+            FROM chat_history
+            WHERE session_id = ?
+            ORDER BY question_id
+        """, session_id)
+
+        for row in cursor:
+            yield {
+                'question_id': row[0],
+                'question': row[1],
+                'answer': row[2],
+                'confidence': row[3], 
+                'sources' : row[4],
+                'accepted': row[5],
+                'edited_answer': row[6]
+            }
+
+
+def get_session_version(session_id):
+
+    flush_feedback()
+
+    # Changes whenever a row is added, answered, edited or approved. HASHBYTES works on
+    # the bytes, so case-only edits count, and unlike CHECKSUM_AGG rows can't cancel out
     with get_db_connection() as conn:
 
         cursor = conn.cursor()
-       
+
         cursor.execute("""
-            UPDATE chat_history
-            SET edited_answer = ?
-            WHERE cache_id = (
-                SELECT cache_id
-                FROM chat_history
-                WHERE question_id = ?
-            )
-        """, (new_answer, question_id))
-        
+            SELECT COUNT(*),
+                   MAX(question_id),
+                   CONVERT(VARCHAR(64), HASHBYTES('SHA2_256', STRING_AGG(
+                       CAST(CONCAT(question_id, '|', answer, '|', edited_answer, '|', accepted, '|', confidence, '|', sources) AS NVARCHAR(MAX)),
+                       NCHAR(30)
+                   ) WITHIN GROUP (ORDER BY question_id)), 2)
+            FROM chat_history
+            WHERE session_id = ?
+        """, session_id)
+
+        count, last_id, digest = cursor.fetchone()
+
+        return f"{count}-{last_id or 0}-{(digest or '0')[:16]}"
+
+
+###=====================================  Write-behind feedback queue  =======================================###
+
+
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "1.0"))
+
+# question_id -> {"accepted": True, "edited_answer": str}, in the order they were last touched
+_pending_feedback = {}
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def _queue_feedback(question_id, **changes):
+
+    question_id = int(question_id)
+
+    with _pending_lock:
+
+        # Re-inserting moves the entry to the end, so the latest edit is written last
+        entry = _pending_feedback.pop(question_id, {})
+        entry.update(changes)
+        _pending_feedback[question_id] = entry
+
+
+def queue_accept(question_id):
+    _queue_feedback(question_id, accepted=True)
+
+
+def queue_edit(question_id, new_answer):
+    _queue_feedback(question_id, edited_answer=new_answer)
+
+
+def flush_feedback():
+
+    # Readers call this too, so they always see their own approvals and edits
+    with _flush_lock:
+
+        with _pending_lock:
+
+            if not _pending_feedback:
+                return
+
+            batch = list(_pending_feedback.items())
+            _pending_feedback.clear()
+
+        accepts = [(qid,) for qid, entry in batch if entry.get("accepted")]
+        edits = [(entry["edited_answer"], qid) for qid, entry in batch if "edited_answer" in entry]
+
+        try:
+            apply_feedback(accepts, edits)
+
+        except Exception:
+
+            # Put the batch back, merged with any change queued meanwhile; the newer fields win
+            with _pending_lock:
+                for qid, entry in batch:
+                    _pending_feedback[qid] = {**entry, **_pending_feedback.pop(qid, {})}
+            raise
+
+
+def start_feedback_flusher():
+
+    def flusher():
+        while True:
+            time.sleep(FEEDBACK_FLUSH_INTERVAL)
+            try:
+                flush_feedback()
+            except Exception as e:
+                print(f"Error flushing feedback: {e}")
+
+    thread = threading.Thread(target=flusher, daemon=True)
+    thread.start()
+
+    return thread
+
+
+atexit.register(flush_feedback)
+
+
+def apply_feedback(accepts, edits):
+
+    # All coalesced approvals and edits go out in one transaction
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        if accepts:
+            cursor.executemany("""
+                UPDATE chat_history
+                SET accepted = 1
+                WHERE cache_id = (
+                    SELECT cache_id
+                    FROM chat_history
+                    WHERE question_id = ?
+                )
+            """, accepts)
+
+        if edits:
+            cursor.executemany("""
+                UPDATE chat_history
+                SET edited_answer = ?
+                WHERE cache_id = (
+                    SELECT cache_id
+                    FROM chat_history
+                    WHERE question_id = ?
+                )
+            """, edits)
+
         conn.commit()
-    
-    
+
+
 def save_chat ( question, answer, sources, confidence,):
 
     with get_db_connection() as conn:
@@ -165,6 +330,8 @@ def update_excell_history(email, session_id, question, answer, confidence, sourc
     
 def get_global_history():
 
+    flush_feedback()
+
     with get_db_connection() as conn:
         
         cursor = conn.cursor()
@@ -195,4 +362,34 @@ def get_global_history():
                 'accepted' : row[6]
             })
         
-        return global_history
\ No newline at end of file
+        return global_history
+
+def get_top_questions(limit):
+    """Most asked cached questions: one row per cache_id, ordered by how often it was served."""
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT TOP (?) question, answer, cache_id, asked
+            FROM (
+                SELECT question, answer, cache_id,
+                    ROW_NUMBER() OVER (PARTITION BY cache_id ORDER BY question_id) as rn,
+                    COUNT(*) OVER (PARTITION BY cache_id) as asked
+                FROM chat_history
+                WHERE cache_id IS NOT NULL
+            ) t
+            WHERE rn = 1 AND answer IS NOT NULL
+            ORDER BY asked DESC;
+        """, (limit,))
+
+        return [
+            {
+                'question': row[0],
+                'answer': row[1],
+                'cache_id': row[2],
+                'asked': row[3]
+            }
+            for row in cursor.fetchall()
+        ]
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; run a single writer process there
+    fcntl = None
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ChunkStore:
+    """Content-addressed chunk text kept outside the vector store.
+
+    Page text is appended once to text.bin; each chunk is an (offset, length) span
+    inside its page, so overlapping chunks share bytes. spans.jsonl maps content
+    hashes to spans and is append-only like text.bin.
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+
+        os.makedirs(directory, exist_ok=True)
+
+        self._text_path = os.path.join(directory, "text.bin")
+        self._spans_path = os.path.join(directory, "spans.jsonl")
+
+        self._lock = threading.Lock()
+
+        self._spans = {}
+        self._spans_offset = 0
+        self._mmap = None
+        self._mapped_size = 0
+
+        self._refresh()
+
+
+    ###======================================  Persistence  =====================================###
+
+
+    def _refresh(self):
+
+        if not os.path.exists(self._spans_path):
+            return
+
+        if os.path.getsize(self._spans_path) == self._spans_offset:
+            return
+
+        with self._lock:
+            self._read_new_spans()
+
+
+    def _read_new_spans(self):
+
+        if not os.path.exists(self._spans_path):
+            return
+
+        with open(self._spans_path, "rb") as f:
+
+            f.seek(self._spans_offset)
+
+            for line in f:
+
+                # A partially written last line is picked up on the next refresh
+                if not line.endswith(b"\n"):
+                    break
+
+                self._spans_offset += len(line)
+
+                key, offset, length = json.loads(line)
+                self._spans[key] = (offset, length)
+
+        self._remap()
+
+
+    def _remap(self):
+
+        size = os.path.getsize(self._text_path) if os.path.exists(self._text_path) else 0
+
+        if size == self._mapped_size or size == 0:
+            return
+
+        with open(self._text_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._mapped_size = size
+
+
+    @contextmanager
+    def _write_lock(self):
+
+        # Spans written by one process must point at bytes that process appended
+        with self._lock, open(os.path.join(self.directory, "write.lock"), "a") as lock_file:
+
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    ###========================================  Writes  =======================================###
+
+
+    def add_page(self, page_text, chunks):
+        """Store a page and its chunks; chunks get a chunk_hash and lose their inline text.
+
+        Chunks must come from a splitter run with add_start_index=True.
+        """
+
+        page_key = text_hash(page_text)
+        page_bytes = page_text.encode("utf-8")
+
+        # Cleaned pages are usually ASCII, where character and byte offsets agree
+        ascii_page = page_text.isascii()
+
+        with self._write_lock():
+
+            self._read_new_spans()
+
+            new_spans = []
+            new_keys = set()
+            data = b""
+
+            end = os.path.getsize(self._text_path) if os.path.exists(self._text_path) else 0
+
+            if page_key in self._spans:
+                page_offset = self._spans[page_key][0]
+            else:
+                page_offset = end
+                data = page_bytes
+                new_spans.append((page_key, page_offset, len(page_bytes)))
+
+            for chunk in chunks:
+
+                text = chunk.page_content
+                key = text_hash(text)
+                start = chunk.metadata.get("start_index", -1)
+
+                chunk.metadata["chunk_hash"] = key
+                chunk.page_content = ""
+
+                if key in self._spans or key in new_keys:
+                    continue
+
+                new_keys.add(key)
+
+                if start < 0:
+
+                    # Not found in the page (shouldn't happen): store the chunk bytes themselves
+                    chunk_bytes = text.encode("utf-8")
+                    new_spans.append((key, end + len(data), len(chunk_bytes)))
+                    data += chunk_bytes
+                    continue
+
+                if ascii_page:
+                    new_spans.append((key, page_offset + start, len(text)))
+                else:
+                    byte_start = len(page_text[:start].encode("utf-8"))
+                    new_spans.append((key, page_offset + byte_start, len(text.encode("utf-8"))))
+
+            # Text before spans: a span is only visible once its bytes are on disk
+            if data:
+                with open(self._text_path, "ab") as f:
+                    f.write(data)
+
+            if new_spans:
+                with open(self._spans_path, "ab") as f:
+                    f.write("".join(json.dumps(span) + "\n" for span in new_spans).encode("utf-8"))
+
+            self._read_new_spans()
+
+        return chunks
+
+
+    ###========================================  Reads  ========================================###
+
+
+    def view(self, key):
+        """Zero-copy view of a chunk's UTF-8 bytes, or None if the hash is unknown."""
+
+        span = self._spans.get(key)
+
+        if span is None:
+            self._refresh()
+            span = self._spans.get(key)
+
+        if span is None:
+            return None
+
+        offset, length = span
+
+        return memoryview(self._mmap)[offset:offset + length]
+
+
+    def text(self, key):
+
+        view = self.view(key)
+
+        return None if view is None else str(view, "utf-8")
+
+
+    def __contains__(self, key):
+        return key in self._spans
+
+
+    def __len__(self):
+        return len(self._spans)
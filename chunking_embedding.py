@@ -1,55 +1,127 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from transformers import AutoTokenizer
 from langchain_chroma import Chroma 
 from langchain_huggingface import HuggingFaceEmbeddings
 import os 
+import chromadb
+
+from embedding_batcher import BatchingEmbeddings
+from embedding_cache import CachedEmbeddings, model_key
+from chunk_store import ChunkStore
+from kb_shards import KB_SHARDING, ShardedKnowledgeBase
+from model_config import embedding_config
+from numpy_store import NumpyVectorStore
 
 
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR")
 CHROMA_PERSIST_DIR_FOR_CACHE = os.getenv("CHROMA_PERSIST_DIR_FOR_CACHE")
 
-tokenizer = AutoTokenizer.from_pretrained('BAAI/bge-small-en-v1.5')
-embedding_model = HuggingFaceEmbeddings(model_name='BAAI/bge-small-en-v1.5') 
+# Optional shared Chroma server, used instead of the local directories when set
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8000"))
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "langchain")
+CHROMA_CACHE_COLLECTION = os.getenv("CHROMA_CACHE_COLLECTION", "semantic_cache")
 
-def chunking(docs):
-    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
-            tokenizer = tokenizer,
-            chunk_size = 500,
-            chunk_overlap = 50,
-        )
-        
-    chunks = text_splitter.split_documents(docs)
-    
-    return chunks
+# "chroma" (HNSW) or "numpy" (exact search over a memory-mapped matrix, for small collections)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+SEMANTIC_CACHE_BACKEND = os.getenv("SEMANTIC_CACHE_BACKEND", "chroma")
+NUMPY_DTYPE = os.getenv("NUMPY_DTYPE", "float32")
+
+# When set, chunk text lives here instead of inside the vector store
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR")
+
+
+def load_embedding_model(config):
+
+    model_kwargs = {"device": config["device"]}
 
+    # Non-default runtimes (e.g. ONNX) are handled by sentence-transformers
+    if config["backend"] != "torch":
+        model_kwargs["backend"] = config["backend"]
 
-def create_vector_store(chunks):
-    vector_store = Chroma.from_documents(
-        documents = chunks,
-        embedding = embedding_model,
-        persist_directory="vector_db",
-        collection_metadata={"hnsw:space": "cosine"} 
+    if config["backend"] == "onnx":
+        model_kwargs["model_kwargs"] = {"file_name": config["onnx_file"]}
+
+    embeddings = HuggingFaceEmbeddings(
+        model_name=config["model_name"],
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": config["batch_size"]}
     )
-    
-    return vector_store
+
+    if config["batch_window_ms"] > 0:
+        embeddings = BatchingEmbeddings(
+            embeddings,
+            max_batch=config["batch_size"],
+            window_ms=config["batch_window_ms"]
+        )
+
+    return embeddings
+
+
+EMBEDDING_CONFIG = embedding_config()
+
+embedding_model = load_embedding_model(EMBEDDING_CONFIG)
+
+# Chunk embeddings only: re-ingested or re-chunked text that was embedded before skips the
+# model. Queries, questions and semantic-cache entries use embedding_model, uncached
+document_embeddings = (
+    CachedEmbeddings(embedding_model, EMBEDDING_CONFIG["cache_dir"], model_key(EMBEDDING_CONFIG))
+    if EMBEDDING_CONFIG["cache_dir"] else embedding_model
+)
+chunk_store = ChunkStore(CHUNK_STORE_DIR) if CHUNK_STORE_DIR else None
+
+
+def chroma_location(persist_directory, collection_name):
+
+    # Several web workers share one index through the server instead of each
+    # opening the sqlite/HNSW files themselves
+    if CHROMA_SERVER_HOST:
+        return {
+            "client": chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT),
+            "collection_name": collection_name,
+        }
+
+    # Local directories keep the default collection name of existing data
+    return {"persist_directory": persist_directory}
+
+
+def numpy_location(persist_directory):
+    return os.path.join(persist_directory or ".", "numpy")
 
 
 def retriever_function():
     
+    # The numpy backend is meant for small knowledge bases, so it is never sharded
+    if VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore(embedding_model, numpy_location(CHROMA_PERSIST_DIR), dtype=NUMPY_DTYPE)
+    
     vector_store = Chroma(
-        persist_directory= CHROMA_PERSIST_DIR,
         embedding_function=embedding_model,
-        collection_metadata={"hnsw:space": "cosine"}  
+        collection_metadata={"hnsw:space": "cosine"},
+        **chroma_location(CHROMA_PERSIST_DIR, CHROMA_COLLECTION)
     )
     
-    return vector_store
+    if KB_SHARDING == "none":
+        return vector_store
+    
+    # New documents go to per-document/per-uploader collections; the original one stays searchable
+    registry_dir = CHROMA_PERSIST_DIR or "."
+    os.makedirs(registry_dir, exist_ok=True)
+    
+    return ShardedKnowledgeBase(
+        embedding_model,
+        location=chroma_location(CHROMA_PERSIST_DIR, CHROMA_COLLECTION),
+        default_store=vector_store,
+        registry_path=os.path.join(registry_dir, "shards.json")
+    )
 
 
 def semantic_retriever():
     
+    if SEMANTIC_CACHE_BACKEND == "numpy":
+        return NumpyVectorStore(embedding_model, numpy_location(CHROMA_PERSIST_DIR_FOR_CACHE), dtype=NUMPY_DTYPE)
+    
     semantic_vector_store = Chroma(
-    persist_directory=CHROMA_PERSIST_DIR_FOR_CACHE,
-    embedding_function = embedding_model
+    embedding_function = embedding_model,
+    **chroma_location(CHROMA_PERSIST_DIR_FOR_CACHE, CHROMA_CACHE_COLLECTION)
     )
     
     return semantic_vector_store
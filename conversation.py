@@ -0,0 +1,139 @@
+import re
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+from chat_history import get_last_question_id, get_user_history
+from model_config import env_int
+
+
+# Earlier questions of a session considered when rewriting a follow-up
+CONVERSATION_TURNS = env_int("CONVERSATION_TURNS", 3)
+
+# Sessions whose recent questions are kept in memory per process
+CONVERSATION_SESSIONS = env_int("CONVERSATION_SESSIONS", 1024)
+
+# Elliptical openings that only make sense after an earlier question, e.g. "what about in children?"
+FOLLOW_UP_OPENINGS = ("what about", "how about", "and ", "also ", "how so")
+
+# Words pointing back at an earlier subject, e.g. "is it safe in pregnancy?"
+REFERRING_WORDS = frozenset({
+    "it", "its", "this", "these", "those", "they", "them", "their", "same",
+})
+
+# Longer questions mentioning "it" or "they" usually name their own subject
+REFERRING_MAX_WORDS = 10
+
+WORD = re.compile(r"[a-z0-9']+")
+
+
+# session_id -> (recent questions, question_id of the newest question this process saw)
+_buffers = OrderedDict()
+_lock = threading.Lock()
+
+
+###===========================================  Session ring buffer  ==========================================###
+
+
+def _load_turns(session_id, current_question_id):
+
+    history = sorted(get_user_history(session_id), key=lambda row: row["question_id"])
+    earlier = [row for row in history if row["question_id"] != current_question_id]
+
+    turns = [row["question"] for row in earlier if row["answer"] is not None][-CONVERSATION_TURNS:]
+
+    return turns, (earlier[-1]["question_id"] if earlier else None)
+
+
+def _is_current(session_id, last_id, current_question_id):
+
+    if current_question_id is None:
+        return True
+
+    # Ids are global, so the next id means no question of any session came in between
+    if last_id is not None and current_question_id == last_id + 1:
+        return True
+
+    # Otherwise another worker may have answered a turn of this session
+    return get_last_question_id(session_id, current_question_id) == last_id
+
+
+def recent_questions(session_id, current_question_id=None):
+
+    with _lock:
+
+        entry = _buffers.get(session_id)
+
+        if entry is not None:
+            _buffers.move_to_end(session_id)
+            turns, last_id = tuple(entry[0]), entry[1]
+
+    if entry is not None and _is_current(session_id, last_id, current_question_id):
+        return turns
+
+    turns, last_id = _load_turns(session_id, current_question_id)
+
+    with _lock:
+
+        entry = [deque(turns, maxlen=CONVERSATION_TURNS), last_id]
+        _buffers[session_id] = entry
+        _buffers.move_to_end(session_id)
+
+        # Least recently used sessions are dropped first
+        while len(_buffers) > CONVERSATION_SESSIONS:
+            _buffers.popitem(last=False)
+
+        return tuple(entry[0])
+
+
+def record_question(session_id, question, question_id=None):
+
+    with _lock:
+
+        entry = _buffers.get(session_id)
+
+        # Sessions not in memory are loaded from chat_history on their next question
+        if entry is not None:
+            entry[0].append(question)
+            if question_id is not None:
+                entry[1] = question_id
+
+
+###=============================================  Query rewrite  =============================================###
+
+
+def is_follow_up(question):
+
+    text = question.strip().lower()
+    words = WORD.findall(text)
+
+    if not words:
+        return False
+
+    if text.startswith(FOLLOW_UP_OPENINGS):
+        return True
+
+    return len(words) <= REFERRING_MAX_WORDS and any(word in REFERRING_WORDS for word in words)
+
+
+@lru_cache(maxsize=4096)
+def condense_question(question, previous):
+    """Rewrite a follow-up into a standalone retrieval query using earlier questions.
+
+    The follow-up is prefixed with the questions back to the last standalone one,
+    e.g. ("first-line treatment for hypertension?",) + "what about in children?".
+    """
+
+    if not previous or not is_follow_up(question):
+        return question
+
+    parts = [question]
+
+    for earlier in reversed(previous):
+
+        parts.insert(0, earlier)
+
+        if not is_follow_up(earlier):
+            break
+
+    return " ".join(part.strip() for part in parts)
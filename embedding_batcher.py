@@ -0,0 +1,74 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+
+class BatchingEmbeddings(Embeddings):
+    """Groups concurrent embed_query calls into one batched model call."""
+
+    def __init__(self, base, max_batch=32, window_ms=5):
+
+        self.base = base
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+
+    def _ensure_worker(self):
+
+        # Threads don't survive fork, so each process starts its own worker
+        with self._lock:
+
+            if self._pid != os.getpid():
+
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+
+                worker = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+                worker.start()
+
+        return self._queue
+
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+
+    def embed_query(self, text):
+
+        future = Future()
+        self._ensure_worker().put((text, future))
+
+        return future.result()
+
+
+    def _run(self, requests):
+
+        while True:
+
+            # Block for the first request, then collect others for a short window
+            batch = [requests.get()]
+
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(requests.get(timeout=self.window))
+            except queue.Empty:
+                pass
+
+            texts = [text for text, _ in batch]
+
+            try:
+                vectors = self.base.embed_documents(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
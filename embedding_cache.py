@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; run a single writer process there
+    fcntl = None
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+DIGEST_SIZE = 20
+
+
+def model_key(config):
+
+    # Different runtimes/weights give slightly different vectors, so each gets its own cache
+    key = f"{config['model_name']}|{config['backend']}"
+
+    if config["backend"] == "onnx":
+        key += f"|{config['onnx_file']}"
+
+    return key
+
+
+class CachedEmbeddings(Embeddings):
+    """Caches document embeddings on disk, keyed by (model, SHA-1 of the text).
+
+    One directory per model holds keys.bin (20-byte digests), vectors.bin (float32
+    rows in the same order, both append-only) and meta.json. Queries are not cached.
+    """
+
+    def __init__(self, base, cache_dir, model):
+
+        self.base = base
+
+        slug = re.sub(r"[^a-zA-Z0-9]+", "_", model).strip("_")[:60]
+        digest = hashlib.sha1(model.encode("utf-8")).hexdigest()[:8]
+
+        self.directory = os.path.join(cache_dir, f"{slug}_{digest}")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._keys_path = os.path.join(self.directory, "keys.bin")
+        self._vectors_path = os.path.join(self.directory, "vectors.bin")
+        self._meta_path = os.path.join(self.directory, "meta.json")
+
+        self._lock = threading.Lock()
+
+        self._row_of = {}
+        self._keys_offset = 0
+        self._vectors = None
+        self.dim = None
+
+        self.hits = 0
+        self.misses = 0
+
+        with self._lock:
+            self._read_new_keys()
+
+
+    ###======================================  Persistence  =====================================###
+
+
+    def _read_new_keys(self):
+
+        if not os.path.exists(self._keys_path):
+            return
+
+        size = os.path.getsize(self._keys_path)
+
+        # A partially written last key is picked up on the next read
+        size -= size % DIGEST_SIZE
+
+        if size == self._keys_offset:
+            return
+
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read(size - self._keys_offset)
+
+        for i in range(0, len(data), DIGEST_SIZE):
+            self._row_of[data[i:i + DIGEST_SIZE]] = len(self._row_of)
+
+        self._keys_offset = size
+
+        if self.dim is None:
+            with open(self._meta_path, encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(len(self._row_of), self.dim))
+
+
+    @contextmanager
+    def _write_lock(self):
+
+        # keys.bin and vectors.bin must grow in step across processes
+        with self._lock, open(os.path.join(self.directory, "write.lock"), "a") as lock_file:
+
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def _append(self, keys, vectors):
+
+        with self._write_lock():
+
+            self._read_new_keys()
+
+            # Skip repeats within the batch and texts another process embedded meanwhile
+            new = []
+            seen = set()
+
+            for i, key in enumerate(keys):
+                if key not in self._row_of and key not in seen:
+                    seen.add(key)
+                    new.append(i)
+
+            if not new:
+                return
+
+            if not os.path.exists(self._meta_path):
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": vectors.shape[1]}, f)
+
+            # Vectors first: a key is only visible once its row is on disk
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors[new].astype(np.float32).tobytes())
+
+            with open(self._keys_path, "ab") as f:
+                f.write(b"".join(keys[i] for i in new))
+
+            self._read_new_keys()
+
+
+    ###=======================================  Embeddings  =====================================###
+
+
+    def embed_documents(self, texts):
+
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() for text in texts]
+
+        with self._lock:
+            self._read_new_keys()
+            rows = [self._row_of.get(key) for key in keys]
+            vectors = self._vectors
+
+        # Repeated texts in one call (e.g. boilerplate chunks) are embedded once
+        missing = list({keys[i]: i for i, row in enumerate(rows) if row is None}.values())
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        computed = {}
+
+        if missing:
+
+            new_keys = [keys[i] for i in missing]
+            new_vectors = np.asarray(self.base.embed_documents([texts[i] for i in missing]), dtype=np.float32)
+
+            self._append(new_keys, new_vectors)
+
+            computed = dict(zip(new_keys, new_vectors))
+
+        return [
+            computed[key].tolist() if row is None else vectors[row].tolist()
+            for key, row in zip(keys, rows)
+        ]
+
+
+    def embed_query(self, text):
+        return self.base.embed_query(text)
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+
+def cache_key(prompt, params):
+
+    # Any change to the model or sampling settings gives a different key
+    header = json.dumps(params, sort_keys=True)
+
+    return hashlib.sha256(f"{header}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Bounded on-disk map from prompt hash to generated text, evicting least recently used.
+
+    The prompt includes the retrieved context, so answers built on changed
+    documents never match an old entry.
+    """
+
+    def __init__(self, path, max_entries=10000):
+
+        self.path = path
+        self.max_entries = max_entries
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with closing(self._connect()) as conn:
+
+            # WAL lets web workers read while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+            conn.commit()
+
+
+    def _connect(self):
+
+        # A connection per call, so nothing is shared across threads or forked workers
+        return sqlite3.connect(self.path, timeout=30)
+
+
+    def get(self, key):
+
+        with closing(self._connect()) as conn:
+
+            row = conn.execute("SELECT answer FROM generations WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+
+            return row[0]
+
+
+    def put(self, key, answer):
+
+        with closing(self._connect()) as conn:
+
+            conn.execute(
+                "INSERT OR REPLACE INTO generations (key, answer, last_used) VALUES (?, ?, ?)",
+                (key, answer, time.time())
+            )
+
+            conn.execute("""
+                DELETE FROM generations
+                WHERE key IN (
+                    SELECT key FROM generations
+                    ORDER BY last_used DESC
+                    LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+            conn.commit()
+
+
+    def __len__(self):
+
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
@@ -0,0 +1,37 @@
+# Multi-worker deployment:  gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master (preload_app) and workers are forked from it,
+# so the embedding model and tokenizer are shared copy-on-write. The master also forks
+# INFERENCE_SLOTS inference processes, each holding one llama.cpp context; web workers
+# send them prompts over a local socket and never load the model, so WEB_WORKERS can
+# grow without adding model memory.
+
+import os
+
+from dotenv import load_dotenv
+
+# BIND, WEB_WORKERS and the rest may come from .env, read here before app.py is imported
+load_dotenv()
+
+
+# Read by app.py so threads are started in the workers, not the master
+os.environ["DEFER_BACKGROUND_TASKS"] = "1"
+
+if not os.getenv("CHROMA_SERVER_HOST"):
+    print("Warning: CHROMA_SERVER_HOST is not set; workers will share the local Chroma files directly")
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_WORKERS", "4"))
+threads = int(os.getenv("WEB_THREADS", "4"))
+preload_app = True
+
+# Generations and bulk uploads can run for minutes
+timeout = int(os.getenv("WEB_TIMEOUT", "600"))
+
+
+def post_fork(server, worker):
+
+    from app import start_background_tasks
+
+    start_background_tasks()
@@ -0,0 +1,338 @@
+# Knowledge base maintenance: delete documents, compact collections, snapshot/restore.
+#
+#   python index_maintenance.py delete "guideline.pdf"
+#   python index_maintenance.py compact --m 32 --ef-construction 200 --ef-search 64
+#   python index_maintenance.py snapshot
+#   python index_maintenance.py restore snapshots/vector_db_20260101_120000
+#   CHUNK_SIZE=300 python index_maintenance.py reindex
+#   python index_maintenance.py to-numpy --collection semantic_cache --target cache_db/numpy
+#   python index_maintenance.py rehash
+#
+# compact and restore rewrite the persisted index, and snapshot copies the live sqlite and
+# HNSW files, which Chroma writes without coordination, so run all three with the app (and
+# any Chroma server) stopped.
+
+import argparse
+import os
+import shutil
+import time
+
+import chromadb
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR")
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8000"))
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "langchain")
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER")
+SNAPSHOT_FOLDER = os.getenv("SNAPSHOT_FOLDER", "snapshots")
+
+# Rows copied per round trip while rebuilding a collection
+COPY_BATCH = 1000
+
+
+def collection_names(client):
+
+    # Older chromadb returns names, newer returns Collection objects
+    return [getattr(c, "name", c) for c in client.list_collections()]
+
+
+def chroma_client():
+
+    if CHROMA_SERVER_HOST:
+        return chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
+
+    return chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+
+
+###===========================================  Document deletion  ============================================###
+
+
+def delete_chunks(vector_store, source):
+
+    # ShardedKnowledgeBase also drops the document's own collection
+    if hasattr(vector_store, "delete_source"):
+        vector_store.delete_source(source)
+    else:
+        vector_store.delete(where={"source": source})
+
+
+def delete_document(vector_store, pdf_name, remove_file=True):
+    """Remove a PDF's chunks, its pdf_main row, cached answers citing it and (optionally) the uploaded file."""
+
+    from semantic_caching import delete_cached_answers
+    from text_extraction import delete_pdf_record
+
+    source = os.path.join(UPLOAD_FOLDER, pdf_name)
+
+    delete_chunks(vector_store, source)
+    delete_pdf_record(pdf_name)
+    delete_cached_answers(pdf_name)
+
+    if remove_file and os.path.exists(source):
+        os.remove(source)
+
+
+###===============================================  Re-indexing  ==============================================###
+
+
+def reindex(vector_store, records, chunk_store=None, embeddings=None):
+    """Re-chunk and re-embed PDFs with the current CHUNK_SIZE/CHUNK_OVERLAP."""
+
+    from ingestion import ingest_pdf, worker_pool
+
+    total = 0
+
+    # One pool for all PDFs instead of one per ingest_pdf call
+    with worker_pool():
+
+        for pdf_name, uploaded_by, _ in records:
+
+            source = os.path.join(UPLOAD_FOLDER, pdf_name)
+
+            if not os.path.exists(source):
+                print(f"Skipping {pdf_name}: file not found")
+                continue
+
+            delete_chunks(vector_store, source)
+
+            total += ingest_pdf(
+                source,
+                vector_store,
+                extra_metadata={"pdf_name": pdf_name, "uploaded_by": uploaded_by},
+                chunk_store=chunk_store,
+                embeddings=embeddings
+            )
+
+    return total
+
+
+###==========================================  Duplicate detection  =========================================###
+
+
+def rehash(records):
+    """Recompute pdf_main.metadata_hash from the uploaded files.
+
+    Rows written before duplicate detection moved to file hashes hold a hash of
+    the cleaned page text, which no new upload matches.
+    """
+
+    from text_extraction import file_hash, update_pdf_hash
+
+    updated = 0
+
+    for pdf_name, _, _ in records:
+
+        source = os.path.join(UPLOAD_FOLDER, pdf_name)
+
+        if not os.path.exists(source):
+            print(f"Skipping {pdf_name}: file not found")
+            continue
+
+        update_pdf_hash(pdf_name, file_hash(source))
+        updated += 1
+
+    return updated
+
+
+###===============================================  Compaction  ===============================================###
+
+
+def compact_collection(client, name, m=16, ef_construction=100, ef_search=100):
+    """Rebuild a collection into a fresh HNSW index, dropping space left by deletions."""
+
+    old = client.get_collection(name)
+    tmp_name = f"{name}_compact"
+
+    metadata = dict(old.metadata or {})
+    metadata.update({
+        "hnsw:space": metadata.get("hnsw:space", "cosine"),
+        "hnsw:M": m,
+        "hnsw:construction_ef": ef_construction,
+        "hnsw:search_ef": ef_search,
+    })
+
+    # A leftover from an interrupted run would otherwise be merged in
+    if tmp_name in collection_names(client):
+        client.delete_collection(tmp_name)
+
+    new = client.create_collection(tmp_name, metadata=metadata)
+
+    offset = 0
+
+    while True:
+
+        batch = old.get(
+            limit=COPY_BATCH,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+
+        if not batch["ids"]:
+            break
+
+        new.add(
+            ids=batch["ids"],
+            embeddings=batch["embeddings"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"]
+        )
+
+        offset += len(batch["ids"])
+
+    client.delete_collection(name)
+    new.modify(name=name)
+
+    return offset
+
+
+###============================================  NumPy backend  ==============================================###
+
+
+def copy_to_numpy(collection, store):
+    """Copy a Chroma collection's stored embeddings into a NumpyVectorStore, without re-embedding."""
+
+    offset = 0
+
+    while True:
+
+        batch = collection.get(
+            limit=COPY_BATCH,
+            offset=offset,
+            include=["embeddings", "documents", "metadatas"]
+        )
+
+        if not batch["ids"]:
+            break
+
+        store.add_embeddings(batch["embeddings"], batch["documents"], batch["metadatas"], batch["ids"])
+
+        offset += len(batch["ids"])
+
+    return offset
+
+
+###==========================================  Snapshot / restore  ============================================###
+
+
+def snapshot(persist_dir=CHROMA_PERSIST_DIR, snapshot_folder=SNAPSHOT_FOLDER):
+    """Copy the persisted index. Only consistent while nothing writes to it (app stopped)."""
+
+    name = f"{os.path.basename(os.path.normpath(persist_dir))}_{time.strftime('%Y%m%d_%H%M%S')}"
+    target = os.path.join(snapshot_folder, name)
+
+    shutil.copytree(persist_dir, target)
+
+    return target
+
+
+def restore(snapshot_path, persist_dir=CHROMA_PERSIST_DIR):
+
+    # Keep the current index until the copy has fully succeeded
+    staging = persist_dir.rstrip("/\\") + "_restoring"
+
+    shutil.copytree(snapshot_path, staging)
+
+    if os.path.exists(persist_dir):
+        shutil.rmtree(persist_dir)
+
+    os.replace(staging, persist_dir)
+
+
+###=================================================  CLI  ===================================================###
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Knowledge base index maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    delete = subparsers.add_parser("delete", help="Remove a PDF from the knowledge base")
+    delete.add_argument("pdf_name")
+    delete.add_argument("--keep-file", action="store_true")
+
+    compact = subparsers.add_parser("compact", help="Rebuild collections with fresh HNSW indexes (app stopped)")
+    compact.add_argument("--collection", help="Defaults to every knowledge base collection")
+    compact.add_argument("--m", type=int, default=16)
+    compact.add_argument("--ef-construction", type=int, default=100)
+    compact.add_argument("--ef-search", type=int, default=100)
+
+    subparsers.add_parser("snapshot", help="Copy the persisted index to SNAPSHOT_FOLDER (app stopped)")
+
+    restore_parser = subparsers.add_parser("restore", help="Replace the persisted index with a snapshot (app stopped)")
+    restore_parser.add_argument("snapshot_path")
+
+    reindex_parser = subparsers.add_parser("reindex", help="Re-chunk and re-embed PDFs with the current settings")
+    reindex_parser.add_argument("pdf_names", nargs="*", help="Defaults to every PDF in pdf_main")
+
+    to_numpy = subparsers.add_parser("to-numpy", help="Copy a collection into the NumPy exact-search backend")
+    to_numpy.add_argument("--collection", default=CHROMA_COLLECTION)
+    to_numpy.add_argument("--target", help="Defaults to CHROMA_PERSIST_DIR/numpy")
+    to_numpy.add_argument("--dtype", default="float32", choices=["float32", "float16", "int8"])
+
+    subparsers.add_parser("rehash", help="Recompute pdf_main hashes from the uploaded files")
+
+    args = parser.parse_args()
+
+    if args.command == "delete":
+
+        from chunking_embedding import retriever_function
+
+        delete_document(retriever_function(), args.pdf_name, remove_file=not args.keep_file)
+        print(f"Deleted {args.pdf_name}")
+
+    elif args.command == "compact":
+
+        client = chroma_client()
+
+        names = [args.collection] if args.collection else [
+            name for name in collection_names(client)
+            if name == CHROMA_COLLECTION or name.startswith("kb_")
+        ]
+
+        for name in names:
+            count = compact_collection(client, name, args.m, args.ef_construction, args.ef_search)
+            print(f"Compacted {name}: {count} vectors")
+
+    elif args.command == "reindex":
+
+        from chunking_embedding import chunk_store, document_embeddings, retriever_function
+        from text_extraction import get_pdf_records
+
+        start = time.perf_counter()
+        count = reindex(retriever_function(), get_pdf_records(pdf_names=args.pdf_names or None), chunk_store, document_embeddings)
+
+        print(f"Re-indexed {count} chunks in {time.perf_counter() - start:.1f} s")
+
+        if hasattr(document_embeddings, "hits"):
+            print(f"Embedding cache: {document_embeddings.hits} hits, {document_embeddings.misses} misses")
+
+    elif args.command == "to-numpy":
+
+        from numpy_store import NumpyVectorStore
+
+        target = args.target or os.path.join(CHROMA_PERSIST_DIR, "numpy")
+        store = NumpyVectorStore(None, target, dtype=args.dtype)
+
+        count = copy_to_numpy(chroma_client().get_collection(args.collection), store)
+        print(f"Copied {count} vectors from {args.collection} to {target}")
+
+    elif args.command == "rehash":
+
+        from text_extraction import get_pdf_records
+
+        print(f"Re-hashed {rehash(get_pdf_records())} PDFs")
+
+    elif args.command == "snapshot":
+        print(f"Snapshot written to {snapshot()}")
+
+    elif args.command == "restore":
+        restore(args.snapshot_path)
+        print(f"Restored {args.snapshot_path}")
+
+
+if __name__ == "__main__":
+    main()
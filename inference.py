@@ -0,0 +1,460 @@
+import atexit
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+
+from langchain_community.llms import LlamaCpp
+
+from generation_cache import GenerationCache, cache_key
+from model_config import env_bool, env_int, llm_config
+
+
+LLM_TEMPERATURE = 0.3
+LLM_STOP = ["Note"]
+
+
+def load_draft_model(draft_mode, num_pred_tokens):
+
+    if draft_mode == "none":
+        return None
+
+    if draft_mode == "prompt_lookup":
+        
+        # Drafts tokens by matching n-grams from the prompt, verified by the main model
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+        
+        return LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens)
+
+    raise ValueError(f"Unknown LLM_DRAFT_MODE: {draft_mode}")
+
+
+def load_llm(draft_mode=None, temperature=LLM_TEMPERATURE):
+    
+    config = llm_config()
+    
+    model_kwargs = {}
+    
+    draft_model = load_draft_model(draft_mode or config["draft_mode"], config["draft_tokens"])
+    
+    if draft_model is not None:
+        model_kwargs["draft_model"] = draft_model
+    
+    local_llm = LlamaCpp(
+        model_path=config["model_path"],
+        n_ctx=config["n_ctx"],
+        n_threads=config["n_threads"],
+        n_batch=config["n_batch"],
+        n_gpu_layers=config["n_gpu_layers"],
+        use_mmap=config["use_mmap"],
+        use_mlock=config["use_mlock"],
+        temperature=temperature,
+        max_tokens=config["max_tokens"],
+        stop=LLM_STOP, 
+        model_kwargs=model_kwargs,
+        verbose=False 
+    )
+    
+    return local_llm
+
+
+###==========================================  Per-process model  ============================================###
+
+
+# Created before gunicorn forks (preload_app), so every web worker shares the same slots
+INFERENCE_SLOTS = env_int("INFERENCE_SLOTS", 1)
+_slots = multiprocessing.BoundedSemaphore(INFERENCE_SLOTS)
+
+_llm = None
+_llm_pid = None
+_llm_lock = threading.Lock()
+
+# One llama.cpp context can't be shared by two threads (in-process model only)
+_generate_lock = threading.Lock()
+
+# Identical prompts (same question and retrieved chunks) reuse the stored answer
+GENERATION_CACHE_PATH = os.getenv("GENERATION_CACHE_PATH")
+GENERATION_CACHE_SIZE = env_int("GENERATION_CACHE_SIZE", 10000)
+
+generation_cache = GenerationCache(GENERATION_CACHE_PATH, GENERATION_CACHE_SIZE) if GENERATION_CACHE_PATH else None
+
+
+def get_llm():
+
+    global _llm, _llm_pid
+
+    # Only used without inference processes (INFERENCE_PROCESSES=0, or no fork on Windows).
+    # Loaded lazily in each process: llama.cpp state does not survive fork
+    with _llm_lock:
+
+        if _llm is None or _llm_pid != os.getpid():
+            _llm = load_llm()
+            _llm_pid = os.getpid()
+
+        return _llm
+
+
+def sampling_params():
+
+    config = llm_config()
+
+    # Taken from the settings, so web workers build cache keys without loading the model
+    defaults = {name: LlamaCpp.model_fields[name].default for name in ("top_p", "top_k", "repeat_penalty")}
+
+    return {
+        "model": config["model_path"],
+        "temperature": LLM_TEMPERATURE,
+        **defaults,
+        "max_tokens": config["max_tokens"],
+        "stop": LLM_STOP,
+    }
+
+
+###==========================================  Inference processes  ==========================================###
+
+
+# The model runs in INFERENCE_SLOTS processes of its own, so its memory (weights mapping,
+# KV cache, compute buffers) doesn't grow with the number of web workers
+INFERENCE_PROCESSES = env_bool("INFERENCE_PROCESSES", hasattr(os, "fork"))
+
+# Slots cap concurrent generations, so a server should pick a request up almost at once;
+# a longer wait means the servers died. A generation longer than INFERENCE_TIMEOUT is given up
+INFERENCE_CONNECT_TIMEOUT = env_int("INFERENCE_CONNECT_TIMEOUT", 30)
+INFERENCE_TIMEOUT = env_int("INFERENCE_TIMEOUT", 600)
+
+_servers = []
+_server_owner = None
+_listener = None
+_authkey = None
+
+
+def _serve(listener, parent):
+
+    # Nothing else stops a server blocked in accept() if the app is killed
+    def watch_parent():
+        while os.getppid() == parent:
+            time.sleep(5)
+        os._exit(0)
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+
+    llm = load_llm()
+
+    # The first generation allocates the compute buffers; pay for it before taking requests
+    llm.invoke("Hello", max_tokens=1)
+
+    while True:
+
+        # Every server accepts on the same socket, so a request goes to whichever one is idle
+        try:
+            conn = listener.accept()
+        except Exception:
+            continue
+
+        with conn:
+
+            try:
+                prompt, kwargs = conn.recv()
+            except EOFError:
+                continue
+
+            try:
+                result = ("ok", llm.invoke(prompt, **kwargs))
+            except Exception as e:
+                result = ("error", f"{type(e).__name__}: {e}")
+
+            # The client may have gone away meanwhile
+            try:
+                conn.send(result)
+            except OSError:
+                pass
+
+
+def _stop_servers():
+
+    # Forked web workers inherit this handler; only the process that started the servers stops them
+    if os.getpid() != _server_owner:
+        return
+
+    for pid in _servers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def start_inference_servers():
+    """Fork the inference processes; call before gunicorn forks its workers (preload_app)."""
+
+    global _server_owner, _listener, _authkey
+
+    if not INFERENCE_PROCESSES or _servers:
+        return
+
+    _authkey = os.urandom(32)
+    _listener = Listener(family="AF_UNIX", authkey=_authkey)
+    _server_owner = os.getpid()
+
+    for _ in range(INFERENCE_SLOTS):
+
+        pid = os.fork()
+
+        if pid == 0:
+            try:
+                _serve(_listener, _server_owner)
+            finally:
+                os._exit(0)
+
+        _servers.append(pid)
+
+    atexit.register(_stop_servers)
+
+    print(f"Started {len(_servers)} inference processes")
+
+
+def _connect():
+
+    # Client() would block forever in the handshake when no server is left to accept
+    sock = socket.socket(socket.AF_UNIX)
+
+    try:
+        sock.settimeout(INFERENCE_CONNECT_TIMEOUT)
+        sock.connect(_listener.address)
+        sock.setblocking(True)
+    except OSError:
+        sock.close()
+        raise
+
+    conn = Connection(sock.detach())
+
+    # The server speaks first once it has accepted
+    if not conn.poll(INFERENCE_CONNECT_TIMEOUT):
+        conn.close()
+        raise RuntimeError(f"No inference process accepted the request within {INFERENCE_CONNECT_TIMEOUT} s")
+
+    answer_challenge(conn, _authkey)
+    deliver_challenge(conn, _authkey)
+
+    return conn
+
+
+def _remote_invoke(prompt, **kwargs):
+
+    with _connect() as conn:
+
+        conn.send((prompt, kwargs))
+
+        if not conn.poll(INFERENCE_TIMEOUT):
+            raise RuntimeError(f"Inference process gave no answer within {INFERENCE_TIMEOUT} s")
+
+        # The accepted connection is only open in the server handling it, so its death closes it
+        try:
+            status, value = conn.recv()
+        except EOFError:
+            raise RuntimeError("Inference process exited during the generation") from None
+
+    if status == "error":
+        raise RuntimeError(f"Inference process failed: {value}")
+
+    return value
+
+
+def invoke(prompt, **kwargs):
+
+    if _servers:
+        return _remote_invoke(prompt, **kwargs)
+
+    return get_llm().invoke(prompt, **kwargs)
+
+
+###==========================================  Priority scheduling  ==========================================###
+
+
+# While chat questions wait, a bulk generation still gets through after this many of them
+BULK_FAIR_SHARE = env_int("BULK_FAIR_SHARE", 4)
+
+PRIORITIES = ("interactive", "bulk")
+
+# Shared across forked workers like _slots, so priorities hold box-wide
+_waiting = {priority: multiprocessing.Value("i", 0) for priority in PRIORITIES}
+_running = {priority: multiprocessing.Value("i", 0) for priority in PRIORITIES}
+_interactive_since_bulk = multiprocessing.Value("i", 0)
+
+
+def _add(counter, delta):
+
+    with counter.get_lock():
+        counter.value += delta
+
+
+def _has_turn(priority):
+
+    fair_share_used = _interactive_since_bulk.value >= BULK_FAIR_SHARE
+
+    if priority == "bulk":
+        return _waiting["interactive"].value == 0 or fair_share_used
+
+    return _waiting["bulk"].value == 0 or not fair_share_used
+
+
+@contextmanager
+def inference_slot(priority):
+    """Hold the model for one generation; bulk work steps aside while chat questions wait."""
+
+    # Inference processes have a context each; an in-process model is shared by this worker's threads
+    local = not _servers
+
+    _add(_waiting[priority], 1)
+
+    try:
+
+        # Polled rather than blocking, so whichever priority has the turn gets the next free slot
+        while True:
+
+            if _has_turn(priority) and (not local or _generate_lock.acquire(blocking=False)):
+
+                # Only INFERENCE_SLOTS generations run at once across all workers
+                if _slots.acquire(block=False):
+                    break
+
+                if local:
+                    _generate_lock.release()
+
+            time.sleep(0.01)
+
+    finally:
+        _add(_waiting[priority], -1)
+
+    with _interactive_since_bulk.get_lock():
+        if priority == "bulk":
+            _interactive_since_bulk.value = 0
+        elif _waiting["bulk"].value > 0:
+            _interactive_since_bulk.value += 1
+
+    _add(_running[priority], 1)
+
+    try:
+        yield
+    finally:
+        _add(_running[priority], -1)
+        _slots.release()
+
+        if local:
+            _generate_lock.release()
+
+
+def queue_status():
+
+    return {
+        "slots": INFERENCE_SLOTS,
+        "waiting": {priority: _waiting[priority].value for priority in PRIORITIES},
+        "running": {priority: _running[priority].value for priority in PRIORITIES},
+    }
+
+
+###==============================================  Generation  ===============================================###
+
+
+def generate(prompt, priority="interactive"):
+
+    key = None
+
+    if generation_cache is not None:
+
+        key = cache_key(prompt, sampling_params())
+        answer = generation_cache.get(key)
+
+        if answer is not None:
+            return answer
+
+    with inference_slot(priority):
+        answer = invoke(prompt)
+
+    if key is not None:
+        generation_cache.put(key, answer)
+
+    return answer
+
+
+###=========================================  Admission control  =============================================###
+
+
+# Interactive generations queued or running per web worker; further requests are turned away
+MAX_PENDING_GENERATIONS = env_int("MAX_PENDING_GENERATIONS", 8)
+
+# Per user and web worker, so one user can't fill the queue
+USER_PENDING_GENERATIONS = env_int("USER_PENDING_GENERATIONS", 2)
+
+_background = None
+_background_pid = None
+_in_flight = 0
+_user_in_flight = {}
+_admission_lock = threading.Lock()
+
+
+class InferenceBusy(Exception):
+    """Raised when this worker, or this user, already has the maximum generations in flight."""
+
+
+def _background_pool():
+
+    global _background, _background_pid, _in_flight, _user_in_flight
+
+    # Threads don't survive fork, so each process starts its own pool
+    if _background_pid != os.getpid():
+        _background = ThreadPoolExecutor(max_workers=MAX_PENDING_GENERATIONS)
+        _background_pid = os.getpid()
+        _in_flight = 0
+        _user_in_flight = {}
+
+    return _background
+
+
+def _over_limit(user):
+    return _in_flight >= MAX_PENDING_GENERATIONS or _user_in_flight.get(user, 0) >= USER_PENDING_GENERATIONS
+
+
+def is_saturated(user=None):
+
+    with _admission_lock:
+        _background_pool()
+        return _over_limit(user)
+
+
+def _release(user):
+
+    global _in_flight
+
+    with _admission_lock:
+
+        _in_flight -= 1
+        _user_in_flight[user] -= 1
+
+        if not _user_in_flight[user]:
+            del _user_in_flight[user]
+
+
+def submit_generation(prompt, user=None):
+    """Start an interactive generation in the background; the caller decides how long to wait."""
+
+    global _in_flight
+
+    with _admission_lock:
+
+        pool = _background_pool()
+
+        if _over_limit(user):
+            raise InferenceBusy()
+
+        _in_flight += 1
+        _user_in_flight[user] = _user_in_flight.get(user, 0) + 1
+
+    future = pool.submit(generate, prompt, "interactive")
+    future.add_done_callback(lambda done: _release(user))
+
+    return future
@@ -0,0 +1,282 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import fitz
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from transformers import AutoTokenizer
+
+from kb_shards import upsert_documents
+from model_config import embedding_config, ingestion_config
+from structure_chunker import StructureChunker
+from text_extraction import clean_extraction
+
+
+INGESTION_CONFIG = ingestion_config()
+
+_executor = None
+_executor_users = 0
+_executor_lock = threading.Lock()
+
+
+###=========================================  Worker process state  ==========================================###
+
+
+_splitter = None
+_chunker = None
+_open_pdf = (None, None)
+
+
+def _init_worker(tokenizer_name, chunk_size, chunk_overlap, chunker="recursive", chunk_tables=False):
+
+    global _splitter, _chunker
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+    if chunker == "structure":
+        _chunker = StructureChunker(tokenizer, chunk_size, chunk_overlap, detect_tables=chunk_tables)
+
+    _splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer = tokenizer,
+        chunk_size = chunk_size,
+        chunk_overlap = chunk_overlap,
+        # Chunk offsets let the chunk store keep each page's text only once
+        add_start_index = True,
+    )
+
+
+def _get_pdf(file_path):
+
+    global _open_pdf
+
+    # Keep the current PDF open so consecutive pages don't reopen the file. A file
+    # replaced under the same name (re-upload, reindex) has a new mtime or size
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+
+    current, pdf = _open_pdf
+
+    if current != key:
+        if pdf is not None:
+            pdf.close()
+        pdf = fitz.open(file_path)
+        _open_pdf = (key, pdf)
+
+    return pdf
+
+
+def _page_metadata(file_path, page_number, pdf):
+
+    return {
+        "source": file_path,
+        "file_path": file_path,
+        "page": page_number,
+        "total_pages": pdf.page_count,
+    }
+
+
+def _extract_page(task):
+
+    file_path, page_number = task
+
+    pdf = _get_pdf(file_path)
+
+    text = clean_extraction(pdf[page_number].get_text())
+
+    return Document(page_content=text, metadata=_page_metadata(file_path, page_number, pdf))
+
+
+def _chunk_page(task):
+
+    if _chunker is not None:
+
+        file_path, page_number = task
+        pdf = _get_pdf(file_path)
+
+        return _chunker.split_page(pdf[page_number], _page_metadata(file_path, page_number, pdf))
+
+    page = _extract_page(task)
+
+    return page.page_content, _splitter.split_documents([page])
+
+
+###==============================================  Pipeline  =================================================###
+
+
+def worker_args(config):
+
+    return (
+        config["model_name"],
+        INGESTION_CONFIG["chunk_size"],
+        INGESTION_CONFIG["chunk_overlap"],
+        INGESTION_CONFIG["chunker"],
+        INGESTION_CONFIG["chunk_tables"],
+    )
+
+
+def get_executor():
+
+    global _executor
+
+    with _executor_lock:
+
+        if _executor is None:
+
+            config = embedding_config()
+
+            # fork shares the parent's loaded modules copy-on-write; spawn would re-import app.py
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+            _executor = ProcessPoolExecutor(
+                max_workers=INGESTION_CONFIG["workers"],
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=worker_args(config)
+            )
+
+        return _executor
+
+
+@contextmanager
+def worker_pool():
+    """Keep the page worker pool for the block; it shuts down when the last user leaves.
+
+    Each web worker would otherwise keep INGEST_WORKERS idle processes between uploads.
+    """
+
+    global _executor, _executor_users
+
+    with _executor_lock:
+        _executor_users += 1
+
+    try:
+        yield
+    finally:
+
+        executor = None
+
+        with _executor_lock:
+            _executor_users -= 1
+            if _executor_users == 0:
+                executor, _executor = _executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+
+def page_count(file_path):
+
+    with fitz.open(file_path) as pdf:
+        return pdf.page_count
+
+
+def _map_pages(func, file_path):
+
+    window = INGESTION_CONFIG["page_window"]
+    total = page_count(file_path)
+
+    # INGEST_WORKERS=0 runs everything in-process (e.g. where only spawn is available)
+    if INGESTION_CONFIG["workers"] == 0:
+
+        if _splitter is None:
+            _init_worker(*worker_args(embedding_config()))
+
+        for n in range(total):
+            yield func((file_path, n))
+
+        return
+
+    executor = get_executor()
+
+    # Only one window of pages is in flight, so memory doesn't grow with the PDF
+    for start in range(0, total, window):
+
+        tasks = [(file_path, n) for n in range(start, min(start + window, total))]
+
+        yield from executor.map(func, tasks, chunksize=4)
+
+
+def iter_pages(file_path):
+    """Yield cleaned pages in order, extracted in the worker pool."""
+    return _map_pages(_extract_page, file_path)
+
+
+def iter_page_chunks(file_path):
+    """Yield (page text, chunks) per page, in order."""
+    return _map_pages(_chunk_page, file_path)
+
+
+def iter_chunks(file_path):
+
+    for _, page_chunks in iter_page_chunks(file_path):
+        yield from page_chunks
+
+
+def add_embedded_documents(vector_store, documents, embeddings):
+
+    # Stores that take precomputed embeddings (NumPy, sharded) do so directly
+    if hasattr(vector_store, "add_embedded_documents"):
+        return vector_store.add_embedded_documents(documents, embeddings)
+
+    return upsert_documents(vector_store, documents, embeddings)
+
+
+def ingest_pdf(file_path, vector_store, extra_metadata=None, chunk_store=None, embeddings=None):
+
+    batch_size = INGESTION_CONFIG["embed_batch"]
+    batch = []
+    texts = []
+    total = 0
+    pages = 0
+    start = time.perf_counter()
+
+    # e.g. the on-disk embedding cache; defaults to the store's own model
+    embedder = embeddings or vector_store.embeddings
+
+    def write_batch():
+
+        # Embedded from the chunk text, which the chunk store may have taken out of page_content
+        add_embedded_documents(vector_store, batch, embedder.embed_documents(texts))
+
+    with worker_pool():
+
+        for page_text, chunks in iter_page_chunks(file_path):
+
+            pages += 1
+            texts.extend(chunk.page_content for chunk in chunks)
+
+            # Moves the text out of page_content and records a chunk_hash instead
+            if chunk_store is not None:
+                chunk_store.add_page(page_text, chunks)
+
+            for chunk in chunks:
+
+                # e.g. pdf_name / uploaded_by, used for shard routing and filters
+                if extra_metadata:
+                    chunk.metadata.update(extra_metadata)
+
+                batch.append(chunk)
+
+            if len(batch) >= batch_size:
+                write_batch()
+                total += len(batch)
+                batch = []
+                texts = []
+
+    if batch:
+        write_batch()
+        total += len(batch)
+
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Ingested {os.path.basename(file_path)}: {pages} pages, {total} chunks in {elapsed:.1f} s "
+        f"({pages / max(elapsed, 1e-9):.1f} pages/s, {INGESTION_CONFIG['chunker']} chunker)"
+    )
+
+    return total
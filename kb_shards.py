@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; run a single writer process there
+    fcntl = None
+
+import numpy as np
+from langchain_chroma import Chroma
+
+
+# "none" keeps one collection; "document" or "uploader" splits the knowledge base
+KB_SHARDING = os.getenv("KB_SHARDING", "none")
+
+# Shards searched per query, picked by similarity to each shard's centroid
+KB_MAX_SHARDS = int(os.getenv("KB_MAX_SHARDS", "4"))
+
+
+def shard_name(key):
+
+    # Chroma collection names: 3-63 chars of [a-zA-Z0-9._-]
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", key).strip("_").lower()[:40]
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:8]
+
+    return f"kb_{slug}_{digest}"
+
+
+def shard_key(metadata, sharding=KB_SHARDING):
+
+    if sharding == "document":
+        return os.path.basename(metadata["source"])
+
+    if sharding == "uploader":
+        return metadata.get("uploaded_by") or "unknown"
+
+    raise ValueError(f"Unknown KB_SHARDING: {sharding}")
+
+
+def upsert_documents(store, documents, embeddings):
+    """Write documents to a Chroma store with precomputed embeddings."""
+
+    ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+
+    # langchain_chroma always embeds page_content, so go through the collection
+    store._collection.upsert(
+        ids=ids,
+        embeddings=[[float(x) for x in vector] for vector in embeddings],
+        documents=[doc.page_content for doc in documents],
+        metadatas=[doc.metadata for doc in documents]
+    )
+
+    return ids
+
+
+class ShardedKnowledgeBase:
+    """Knowledge base split over several Chroma collections, searched in parallel."""
+
+    def __init__(self, embedding_model, location, default_store, registry_path, sharding=KB_SHARDING):
+
+        self.embedding_model = embedding_model
+        self.location = location
+        self.sharding = sharding
+        self.registry_path = registry_path
+
+        # The original single collection is always searched, so existing data stays visible
+        self.default_store = default_store
+
+        # name -> (Chroma handle, "created" token of the registry entry it was opened for)
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._registry = self._load_registry()
+        self._pool = ThreadPoolExecutor(max_workers=KB_MAX_SHARDS + 1)
+
+
+    @property
+    def embeddings(self):
+        return self.embedding_model
+
+
+    ###====================================  Shard registry  ====================================###
+
+
+    def _load_registry(self):
+
+        if not os.path.exists(self.registry_path):
+            self._registry_mtime = None
+            return {}
+
+        self._registry_mtime = os.path.getmtime(self.registry_path)
+
+        with open(self.registry_path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+    def _set_registry(self, registry):
+
+        # Called holding self._lock. A handle whose shard was deleted, or deleted and
+        # re-created, still points at the old collection id, so it is reopened
+        for name in list(self._stores):
+            entry = registry.get(name)
+            if entry is None or entry.get("created") != self._stores[name][1]:
+                del self._stores[name]
+
+        self._registry = registry
+
+
+    def _refresh_registry(self):
+
+        # Pick up shards added or removed by other web workers
+        if os.path.exists(self.registry_path) and os.path.getmtime(self.registry_path) != self._registry_mtime:
+            with self._lock:
+                self._set_registry(self._load_registry())
+
+
+    @contextmanager
+    def _update_registry(self):
+
+        # Re-read under a file lock before each change, so workers never overwrite each other's shards
+        with self._lock, open(self.registry_path + ".lock", "a") as lock_file:
+
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                self._set_registry(self._load_registry())
+                yield self._registry
+                self._save_registry()
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def _save_registry(self):
+
+        tmp_path = self.registry_path + ".tmp"
+
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._registry, f)
+
+        os.replace(tmp_path, self.registry_path)
+        self._registry_mtime = os.path.getmtime(self.registry_path)
+
+
+    def shards(self):
+        return {name: entry["key"] for name, entry in self._registry.items()}
+
+
+    def store(self, name):
+
+        with self._lock:
+
+            if name not in self._stores:
+
+                handle = Chroma(
+                    embedding_function=self.embedding_model,
+                    collection_metadata={"hnsw:space": "cosine"},
+                    **{**self.location, "collection_name": name}
+                )
+
+                self._stores[name] = (handle, self._registry.get(name, {}).get("created"))
+
+            return self._stores[name][0]
+
+
+    ###=======================================  Ingestion  ======================================###
+
+
+    def add_documents(self, documents):
+        return self.add_embedded_documents(documents, None)
+
+
+    def add_embedded_documents(self, documents, embeddings):
+
+        # Drops handles to shards another worker deleted since the last refresh
+        self._refresh_registry()
+
+        groups = {}
+
+        for i, doc in enumerate(documents):
+            groups.setdefault(shard_key(doc.metadata, self.sharding), []).append(i)
+
+        ids = []
+
+        for key, indexes in groups.items():
+
+            name = shard_name(key)
+            store = self.store(name)
+            docs = [documents[i] for i in indexes]
+
+            if embeddings is None:
+                new_ids = store.add_documents(docs)
+                vectors = np.asarray(store.get(ids=new_ids, include=["embeddings"])["embeddings"])
+            else:
+                vectors = np.asarray([embeddings[i] for i in indexes])
+                new_ids = upsert_documents(store, docs, vectors)
+
+            ids.extend(new_ids)
+
+            # Keep a running centroid per shard for query routing
+            with self._update_registry() as registry:
+
+                entry = registry.setdefault(name, {
+                    "key": key,
+                    "created": uuid.uuid4().hex,
+                    "count": 0,
+                    "sum": [0.0] * vectors.shape[1],
+                })
+
+                entry["count"] += len(vectors)
+                entry["sum"] = (np.asarray(entry["sum"]) + vectors.sum(axis=0)).tolist()
+
+        return ids
+
+
+    def delete_source(self, source):
+
+        self._refresh_registry()
+
+        if self.sharding == "document":
+
+            name = shard_name(os.path.basename(source))
+
+            if name in self._registry:
+                self.store(name).delete_collection()
+                self.remove_shard(name)
+
+        else:
+
+            # Uploader shards mix documents, so delete the chunks and leave the centroid
+            for name in list(self._registry):
+                self.store(name).delete(where={"source": source})
+
+        self.default_store.delete(where={"source": source})
+
+
+    def remove_shard(self, name):
+
+        with self._update_registry() as registry:
+            registry.pop(name, None)
+            self._stores.pop(name, None)
+
+
+    ###========================================  Search  ========================================###
+
+
+    def route(self, query_vector, candidates=None):
+
+        self._refresh_registry()
+
+        names = [name for name in self._registry if candidates is None or name in candidates]
+
+        # Filtered searches cover every shard that can hold a match; centroid routing could skip one
+        if candidates is not None or len(names) <= KB_MAX_SHARDS:
+            return names
+
+        centroids = np.asarray([self._registry[name]["sum"] for name in names])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+        query = np.asarray(query_vector)
+        query = query / np.linalg.norm(query)
+
+        scores = centroids @ query
+        top = np.argpartition(-scores, KB_MAX_SHARDS - 1)[:KB_MAX_SHARDS]
+
+        return [names[i] for i in top]
+
+
+    def similarity_search_with_score(self, query, k=4, filter=None, shards=None):
+
+        query_vector = self.embedding_model.embed_query(query)
+
+        stores = [self.store(name) for name in self.route(query_vector, shards)]
+        stores.append(self.default_store)
+
+        futures = [
+            self._pool.submit(store.similarity_search_by_vector_with_relevance_scores, query_vector, k, filter)
+            for store in stores
+        ]
+
+        results = [pair for future in futures for pair in future.result()]
+
+        # Scores are cosine distances, so the smallest are the best matches
+        results.sort(key=lambda pair: pair[1])
+
+        return results[:k]
@@ -0,0 +1,143 @@
+import os
+
+from dotenv import load_dotenv
+
+# For scripts that import this first; app.py loads .env before any project module reads its settings
+load_dotenv()
+
+
+# Known GGUF models and the quantization variants available for each
+MODEL_REGISTRY = {
+    "llama-3.2-3b": {
+        "file": "Llama-3.2-3B-Instruct-{quant}.gguf",
+        "quants": ["Q4_K_M", "Q5_K_M", "Q8_0"],
+        "default_quant": "Q4_K_M",
+    },
+    "phi-3-mini": {
+        "file": "Phi-3-mini-4k-instruct-{quant}.gguf",
+        "quants": ["q4", "fp16"],
+        "default_quant": "q4",
+    },
+    "tinyllama-1.1b": {
+        "file": "tinyllama-1.1b-chat-v1.0.{quant}.gguf",
+        "quants": ["Q4_K_M", "Q8_0"],
+        "default_quant": "Q4_K_M",
+    },
+    "mistral-7b": {
+        "file": "mistral-7b-instruct-v0.2.{quant}.gguf",
+        "quants": ["Q4_K_M", "Q5_K_M"],
+        "default_quant": "Q4_K_M",
+    },
+    "llama-2-7b": {
+        "file": "llama-2-7b-chat.{quant}.gguf",
+        "quants": ["Q4_K_M"],
+        "default_quant": "Q4_K_M",
+    },
+}
+
+
+def env_bool(name, default):
+
+    value = os.getenv(name)
+
+    if value is None:
+        return default
+
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name, default):
+
+    value = os.getenv(name)
+
+    if value is None or value == "":
+        return default
+
+    return int(value)
+
+
+def available_cores():
+
+    # Respect CPU affinity / container limits where the platform exposes them
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_threads():
+
+    # Leave one core for Flask and the embedding model
+    return max(1, available_cores() - 1)
+
+
+def resolve_model_path(model_name, quant):
+
+    if model_name not in MODEL_REGISTRY:
+        raise ValueError(f"Unknown LLM_MODEL: {model_name}")
+
+    entry = MODEL_REGISTRY[model_name]
+    quant = quant or entry["default_quant"]
+
+    if quant not in entry["quants"]:
+        raise ValueError(f"Quantization {quant} not available for {model_name}")
+
+    model_dir = os.getenv("MODEL_DIR", "models")
+
+    return os.path.join(model_dir, entry["file"].format(quant=quant))
+
+
+def llm_config():
+
+    model_name = os.getenv("LLM_MODEL", "llama-3.2-3b")
+
+    # An explicit path overrides the registry lookup
+    model_path = os.getenv("LLM_MODEL_PATH") or resolve_model_path(model_name, os.getenv("LLM_QUANT"))
+
+    return {
+        "model_path": model_path,
+        "n_ctx": env_int("LLM_N_CTX", 2048),
+        "n_threads": env_int("LLM_N_THREADS", default_threads()),
+        "n_batch": env_int("LLM_N_BATCH", 512),
+        "n_gpu_layers": env_int("LLM_N_GPU_LAYERS", 0),
+        "max_tokens": env_int("LLM_MAX_TOKENS", 200),
+        "use_mmap": env_bool("LLM_USE_MMAP", True),
+        "use_mlock": env_bool("LLM_USE_MLOCK", False),
+        # Speculative decoding: "none" or "prompt_lookup"
+        "draft_mode": os.getenv("LLM_DRAFT_MODE", "none"),
+        "draft_tokens": env_int("LLM_DRAFT_TOKENS", 10),
+    }
+
+
+def embedding_config():
+
+    return {
+        "model_name": os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5"),
+        # sentence-transformers backend: "torch", "onnx" or "openvino"
+        "backend": os.getenv("EMBEDDING_BACKEND", "torch"),
+        "device": os.getenv("EMBEDDING_DEVICE", "cpu"),
+        "batch_size": env_int("EMBEDDING_BATCH_SIZE", 32),
+        # ONNX file inside the model repo; point at an int8 export to quantize
+        "onnx_file": os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx"),
+        # Concurrent query embeddings are grouped for up to this long; 0 disables
+        "batch_window_ms": env_int("EMBEDDING_BATCH_WINDOW_MS", 5),
+        # Directory for cached document embeddings; unset disables the cache
+        "cache_dir": os.getenv("EMBEDDING_CACHE_DIR"),
+    }
+
+
+def ingestion_config():
+
+    return {
+        "workers": env_int("INGEST_WORKERS", available_cores()),
+        # Pages extracted and chunked per round trip to the worker pool
+        "page_window": env_int("INGEST_PAGE_WINDOW", 64),
+        # Chunks embedded and written to the vector store per call
+        "embed_batch": env_int("INGEST_EMBED_BATCH", 256),
+        "chunk_size": env_int("CHUNK_SIZE", 500),
+        "chunk_overlap": env_int("CHUNK_OVERLAP", 50),
+        # "recursive" (character splitter) or "structure" (section-aligned, from layout blocks)
+        "chunker": os.getenv("CHUNKER", "recursive"),
+        # structure chunker only: keep tables whole (PyMuPDF table detection is slow)
+        "chunk_tables": env_bool("CHUNK_TABLES", False),
+    }
@@ -0,0 +1,454 @@
+import json
+import os
+import threading
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; run a single writer process there
+    fcntl = None
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+# Rows scored per matmul, so float16/int8 matrices are never upcast in full
+SEARCH_BLOCK = 65536
+
+# int8 stores re-score this many candidates per result against the float32 rows
+RESCORE_FACTOR = int(os.getenv("NUMPY_RESCORE_FACTOR", "4"))
+
+# Arrays one search works on; metadatas only grows, so its first len(alive) rows are stable
+Snapshot = namedtuple("Snapshot", ["matrix", "scales", "full", "alive", "metadatas"])
+
+
+def _matches(metadata, where):
+
+    # Supports the subset of Chroma's where syntax the app uses: equality and $in
+    for key, condition in where.items():
+
+        value = metadata.get(key)
+
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+        elif value != condition:
+            return False
+
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine search over normalized embeddings held in a memory-mapped matrix.
+
+    A directory holds vectors.bin (raw rows), records.jsonl (id, text, metadata and
+    deletions, append-only) and meta.json (dimension and dtype).
+
+    With dtype "int8" the rows are scalar-quantized with a per-row scale (scales.bin)
+    and scanned at a quarter of the float32 size. The float32 rows are kept in
+    full.bin and only the top candidates are read back from it for exact re-scoring.
+    """
+
+    def __init__(self, embedding_function, persist_directory, dtype="float32"):
+
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+
+        os.makedirs(persist_directory, exist_ok=True)
+
+        self._vectors_path = os.path.join(persist_directory, "vectors.bin")
+        self._records_path = os.path.join(persist_directory, "records.jsonl")
+        self._meta_path = os.path.join(persist_directory, "meta.json")
+        self._scales_path = os.path.join(persist_directory, "scales.bin")
+        self._full_path = os.path.join(persist_directory, "full.bin")
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            meta = {"dim": None, "dtype": dtype}
+
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+
+        self._lock = threading.Lock()
+
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._alive = []
+        self._row_of = {}
+        self._records_offset = 0
+        self._matrix = None
+        self._scales = None
+        self._full = None
+        self._alive_mask = np.zeros(0, dtype=bool)
+
+        self._refresh()
+
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+
+    @property
+    def quantized(self):
+        return self.dtype == np.int8
+
+
+    ###======================================  Persistence  =====================================###
+
+
+    def _refresh(self):
+
+        # Other processes may have appended rows; read only what is new
+        if not os.path.exists(self._records_path):
+            return
+
+        if os.path.getsize(self._records_path) == self._records_offset:
+            return
+
+        with self._lock:
+            self._read_new_records()
+
+
+    def _read_new_records(self):
+
+        if not os.path.exists(self._records_path):
+            return
+
+        # The store may have been created by another process after this one opened it
+        if self.dim is None:
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+
+        with open(self._records_path, "rb") as f:
+
+            f.seek(self._records_offset)
+
+            for line in f:
+
+                # A partially written last line is picked up on the next refresh
+                if not line.endswith(b"\n"):
+                    break
+
+                self._records_offset += len(line)
+                self._apply_record(json.loads(line))
+
+        self._remap()
+
+
+    @contextmanager
+    def _write_lock(self):
+
+        # Rows in vectors.bin must stay in the same order as records.jsonl across processes
+        with self._lock, open(os.path.join(self.persist_directory, "write.lock"), "a") as lock_file:
+
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def _apply_record(self, record):
+
+        if "delete" in record:
+            row = self._row_of.pop(record["delete"], None)
+            if row is not None:
+                self._alive[row] = False
+            return
+
+        self._row_of[record["id"]] = len(self._ids)
+        self._ids.append(record["id"])
+        self._texts.append(record["text"])
+        self._metadatas.append(record["metadata"])
+        self._alive.append(True)
+
+
+    def _remap(self):
+
+        rows = len(self._ids)
+
+        # Built once per refresh instead of on every query
+        self._alive_mask = np.asarray(self._alive, dtype=bool)
+
+        if rows == 0:
+            self._matrix = None
+            return
+
+        self._matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+
+        if self.quantized:
+            self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(rows,))
+            self._full = np.memmap(self._full_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+
+    def _append(self, vectors, records):
+
+        with self._write_lock():
+
+            if self.dim is None and os.path.exists(self._meta_path):
+                self._read_new_records()
+
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+
+            # Vectors first: a record is only visible once its row is on disk
+            if self.quantized:
+
+                codes, scales = self.quantize(vectors)
+
+                with open(self._vectors_path, "ab") as f:
+                    f.write(codes.tobytes())
+                with open(self._scales_path, "ab") as f:
+                    f.write(scales.tobytes())
+                with open(self._full_path, "ab") as f:
+                    f.write(vectors.astype(np.float32).tobytes())
+
+            else:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors.astype(self.dtype).tobytes())
+
+            lines = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+            with open(self._records_path, "ab") as f:
+                f.write(lines)
+
+            # Reads other processes' rows too, keeping row numbers aligned with the file
+            self._read_new_records()
+
+
+    ###========================================  Writes  =======================================###
+
+
+    @staticmethod
+    def normalize(vectors):
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+        return vectors / np.maximum(norms, 1e-12)
+
+
+    @staticmethod
+    def quantize(vectors):
+
+        # Symmetric per-row scale, so each row uses the full int8 range
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+
+        return codes, scales.astype(np.float32)
+
+
+    def add_embeddings(self, embeddings, texts, metadatas=None, ids=None):
+
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+
+        records = [
+            {"id": id_, "text": text, "metadata": metadata}
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        ]
+
+        self._append(self.normalize(embeddings), records)
+
+        return ids
+
+
+    def add_embedded_documents(self, documents, embeddings):
+
+        return self.add_embeddings(
+            embeddings,
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents],
+            [doc.id for doc in documents] if all(doc.id for doc in documents) else None
+        )
+
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+
+        texts = list(texts)
+
+        embeddings = self.embedding_function.embed_documents(texts)
+
+        return self.add_embeddings(embeddings, texts, metadatas, ids)
+
+
+    def delete(self, ids=None, where=None, **kwargs):
+
+        self._refresh()
+
+        if where is not None:
+            ids = [
+                id_ for id_, metadata, alive in zip(self._ids, self._metadatas, self._alive)
+                if alive and _matches(metadata, where)
+            ]
+
+        ids = [id_ for id_ in (ids or []) if id_ in self._row_of]
+
+        if not ids:
+            return
+
+        lines = "".join(json.dumps({"delete": id_}) + "\n" for id_ in ids).encode("utf-8")
+
+        with self._write_lock():
+
+            with open(self._records_path, "ab") as f:
+                f.write(lines)
+
+            self._read_new_records()
+
+
+    ###========================================  Search  =======================================###
+
+
+    def _snapshot(self):
+
+        # Taken together: a refresh or append in another thread replaces the matrix and
+        # mask, and mixing old and new ones gives mismatched row counts
+        with self._lock:
+            return Snapshot(self._matrix, self._scales, self._full, self._alive_mask, self._metadatas)
+
+
+    def _candidate_mask(self, snapshot, filter):
+
+        alive = snapshot.alive
+
+        if filter:
+            rows = len(alive)
+            alive = alive & np.fromiter((_matches(snapshot.metadatas[i], filter) for i in range(rows)), dtype=bool, count=rows)
+
+        return alive
+
+
+    def _top_rows(self, snapshot, queries, k, mask):
+
+        matrix = snapshot.matrix
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+        for start in range(0, matrix.shape[0], SEARCH_BLOCK):
+
+            block = np.asarray(matrix[start:start + SEARCH_BLOCK], dtype=np.float32)
+            scores = queries @ block.T
+
+            if snapshot.scales is not None:
+                scores *= snapshot.scales[start:start + SEARCH_BLOCK]
+
+            scores[:, ~mask[start:start + SEARCH_BLOCK]] = -np.inf
+
+            # Keep only each block's top k, then merge with the running best
+            top = min(k, scores.shape[1])
+            rows = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+
+            best_rows = np.concatenate([best_rows, rows + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, rows, axis=1)], axis=1)
+
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        return best_rows, best_scores
+
+
+    def _rescore(self, snapshot, queries, rows, scores):
+
+        # Only the candidate rows are read from full.bin
+        for i, query in enumerate(queries):
+            live = np.isfinite(scores[i])
+            scores[i, live] = snapshot.full[rows[i, live]] @ query
+
+        return scores
+
+
+    def search_vectors(self, query_vectors, k=4, filter=None, rescore=True):
+        """Return, per query, a list of (row, cosine distance) for the k nearest rows."""
+
+        self._refresh()
+
+        queries = self.normalize(np.atleast_2d(query_vectors))
+
+        snapshot = self._snapshot()
+
+        if snapshot.matrix is None:
+            return [[] for _ in queries]
+
+        mask = self._candidate_mask(snapshot, filter)
+
+        if snapshot.full is not None and rescore:
+            rows, scores = self._top_rows(snapshot, queries, k * RESCORE_FACTOR, mask)
+            scores = self._rescore(snapshot, queries, rows, scores)
+        else:
+            rows, scores = self._top_rows(snapshot, queries, k, mask)
+
+        order = np.argsort(-scores, axis=1)[:, :k]
+        rows = np.take_along_axis(rows, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+
+        return [
+            [(int(row), float(1 - score)) for row, score in zip(query_rows, query_scores) if np.isfinite(score)]
+            for query_rows, query_scores in zip(rows, scores)
+        ]
+
+
+    def _to_documents(self, hits):
+
+        return [
+            (Document(page_content=self._texts[row], metadata=dict(self._metadatas[row]), id=self._ids[row]), distance)
+            for row, distance in hits
+        ]
+
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        return self._to_documents(self.search_vectors(embedding, k, filter)[0])
+
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+
+        # Scores are cosine distances, matching the Chroma collections
+        embedding = self.embedding_function.embed_query(query)
+
+        return self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)
+
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+
+    def similarity_search_batch_with_score(self, queries, k=4, filter=None):
+
+        # One matmul answers every query
+        embeddings = self.embedding_function.embed_documents(list(queries))
+
+        return [self._to_documents(hits) for hits in self.search_vectors(embeddings, k, filter)]
+
+
+    def __len__(self):
+        self._refresh()
+        return int(np.count_nonzero(self._alive_mask))
+
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+
+        store = cls(embedding, persist_directory, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+
+        return store
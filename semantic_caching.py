@@ -4,6 +4,7 @@ import uuid
 from langchain_core.documents import Document
 
 from user_auth import get_db_connection
+from chat_history import flush_feedback
 from chunking_embedding import semantic_retriever
 
 
@@ -48,6 +49,9 @@ def get_from_chat_history(cache_id):
     if not cache_id:
         return None
 
+    # Pending approvals/edits must be visible to cache hits
+    flush_feedback()
+
     query = """
         SELECT answer, sources, confidence, cache_id, accepted, edited_answer
         FROM chat_history
@@ -102,6 +106,31 @@ def search_cache(question, threshold=0.60):
     return str(doc.metadata.get("cache_id"))
 
 
+# ===============================
+# Chroma: Delete
+# ===============================
+
+def delete_cached_answers(pdf_name):
+    """Drop cache entries whose answers cite pdf_name, so they stop being served once it is deleted."""
+
+    # Sources are stored as lines like "[1] guideline.pdf (Page 3)"
+    name = pdf_name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("[", "\\[")
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT cache_id
+            FROM chat_history
+            WHERE cache_id IS NOT NULL AND sources LIKE ? ESCAPE '\\'
+        """, (f"%] {name} (Page %",))
+        cache_ids = [str(row[0]) for row in cursor.fetchall()]
+
+    if cache_ids:
+        semantic_vector_store.delete(where={"cache_id": {"$in": cache_ids}})
+
+    return len(cache_ids)
+
+
 # ===============================
 # Cache ID
 # ===============================
@@ -0,0 +1,230 @@
+import re
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from text_extraction import clean_extraction
+
+
+# Bullets and enumerations that open a list item, e.g. "•", "-", "1.", "(a)"
+LIST_ITEM = re.compile(r"^\s*(?:[•●▪◦–*-]|\(?\d{1,2}[.)]|\(?[a-z][.)])\s+")
+
+# A heading is a short block set larger than the body text, or fully bold
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 120
+
+BOLD_FLAG = 16
+
+
+class StructureChunker:
+    """Section-aligned chunking from PyMuPDF layout blocks.
+
+    Each page is tokenized once, with one batched call over its blocks. Blocks are
+    packed into chunks of at most chunk_size tokens. A heading always starts a new
+    chunk, and a block longer than chunk_size is split on token boundaries.
+    """
+
+    def __init__(self, tokenizer, chunk_size, chunk_overlap, detect_tables=False):
+
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.detect_tables = detect_tables
+
+
+    ###=========================================  Layout  =======================================###
+
+
+    def _table_blocks(self, page):
+
+        blocks = []
+
+        for table in page.find_tables().tables:
+
+            rows = [" | ".join(cell or "" for cell in row) for row in table.extract()]
+            blocks.append({"bbox": table.bbox, "text": "\n".join(rows), "kind": "table"})
+
+        return blocks
+
+
+    def layout_blocks(self, page):
+        """Return the page's blocks in reading order as dicts with text and kind."""
+
+        layout = page.get_text("dict", sort=True)["blocks"]
+
+        tables = self._table_blocks(page) if self.detect_tables else []
+
+        spans = [
+            span
+            for block in layout if block["type"] == 0
+            for line in block["lines"]
+            for span in line["spans"]
+            if span["text"].strip()
+        ]
+
+        # The most common size by character count is the body text
+        sizes = Counter()
+        for span in spans:
+            sizes[round(span["size"] * 2) / 2] += len(span["text"])
+
+        body_size = sizes.most_common(1)[0][0] if sizes else 0
+
+        blocks = []
+
+        for block in layout:
+
+            if block["type"] != 0:
+                continue
+
+            # Text inside a detected table is emitted once, as the table
+            if any(_inside(block["bbox"], table["bbox"]) for table in tables):
+                continue
+
+            block_spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+
+            if not block_spans:
+                continue
+
+            raw = "\n".join("".join(span["text"] for span in line["spans"]) for line in block["lines"])
+            text = clean_extraction(raw)
+
+            if not text:
+                continue
+
+            blocks.append({"bbox": block["bbox"], "text": text, "kind": self._kind(text, block_spans, body_size)})
+
+        for table in tables:
+            table["text"] = clean_extraction(table["text"].replace("\n", " ; "))
+            blocks.append(table)
+
+        if tables:
+            blocks.sort(key=lambda block: (block["bbox"][1], block["bbox"][0]))
+
+        return blocks
+
+
+    def _kind(self, text, spans, body_size):
+
+        if len(text) <= HEADING_MAX_CHARS and not text.endswith((".", ",", ";")):
+
+            largest = max(span["size"] for span in spans)
+            all_bold = all(span["flags"] & BOLD_FLAG for span in spans)
+
+            if largest >= body_size * HEADING_SIZE_RATIO or all_bold:
+                return "heading"
+
+        if LIST_ITEM.match(text):
+            return "list"
+
+        return "paragraph"
+
+
+    ###========================================  Chunking  ======================================###
+
+
+    def _units(self, blocks, starts):
+
+        texts = [block["text"] for block in blocks]
+
+        # One tokenizer call per page instead of one per candidate split
+        encoded = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+
+        for block, start, offsets in zip(blocks, starts, encoded["offset_mapping"]):
+
+            if len(offsets) <= self.chunk_size:
+                yield {**block, "start": start, "end": start + len(block["text"]), "tokens": len(offsets)}
+                continue
+
+            # Overlong blocks (e.g. a page-long paragraph) are windowed on token boundaries
+            step = max(self.chunk_size - self.chunk_overlap, 1)
+
+            for i in range(0, len(offsets), step):
+
+                window = offsets[i:i + self.chunk_size]
+
+                yield {
+                    **block,
+                    "start": start + window[0][0],
+                    "end": start + window[-1][1],
+                    "tokens": len(window),
+                }
+
+                if i + self.chunk_size >= len(offsets):
+                    break
+
+
+    def split_page(self, page, metadata):
+        """Return the page text and its chunks; chunks are substrings of the page text."""
+
+        blocks = self.layout_blocks(page)
+
+        if not blocks:
+            return "", []
+
+        # Blocks are joined by newlines, so each chunk is one contiguous slice of the page
+        starts = []
+        position = 0
+
+        for block in blocks:
+            starts.append(position)
+            position += len(block["text"]) + 1
+
+        page_text = "\n".join(block["text"] for block in blocks)
+
+        chunks = []
+        current = []
+        section = None
+
+        def flush(keep_overlap):
+
+            nonlocal current
+
+            first, last = current[0], current[-1]
+
+            chunk_metadata = {**metadata, "start_index": first["start"]}
+            if section:
+                chunk_metadata["section"] = section
+
+            chunks.append(Document(page_content=page_text[first["start"]:last["end"]], metadata=chunk_metadata))
+
+            tail = []
+            tokens = 0
+
+            if keep_overlap:
+                for unit in reversed(current):
+                    tokens += unit["tokens"]
+                    if tokens > self.chunk_overlap:
+                        break
+                    tail.insert(0, unit)
+
+            current = tail
+
+        for unit in self._units(blocks, starts):
+
+            # Sections never share a chunk
+            if unit["kind"] == "heading":
+                if current:
+                    flush(keep_overlap=False)
+                section = unit["text"]
+
+            elif current and sum(u["tokens"] for u in current) + unit["tokens"] > self.chunk_size:
+
+                flush(keep_overlap=True)
+
+                # The overlap gives way to the new unit, so no chunk exceeds the model's input size
+                while current and sum(u["tokens"] for u in current) + unit["tokens"] > self.chunk_size:
+                    current.pop(0)
+
+            current.append(unit)
+
+        if current:
+            flush(keep_overlap=False)
+
+        return page_text, chunks
+
+
+def _inside(inner, outer):
+
+    x0, y0, x1, y1 = inner
+
+    return x0 >= outer[0] - 1 and y0 >= outer[1] - 1 and x1 <= outer[2] + 1 and y1 <= outer[3] + 1
@@ -0,0 +1,129 @@
+import pytest
+
+import conversation
+from conversation import condense_question, is_follow_up
+
+
+STANDALONE = [
+    "What is sepsis?",
+    "Why does metformin cause lactic acidosis?",
+    "How much paracetamol is safe for adults per day?",
+    "How long should antibiotics be given for pneumonia?",
+    "In which patients is warfarin contraindicated?",
+    "Is there a vaccine for measles?",
+    "Which drugs that prolong the QT interval should be avoided with macrolides?",
+    "What are the first-line treatments for hypertension in adults?",
+    "Dose of amoxicillin?",
+]
+
+FOLLOW_UPS = [
+    "What about in children?",
+    "how about the elderly?",
+    "And in pregnancy?",
+    "Also for renal failure?",
+    "How so?",
+    "Is it safe in pregnancy?",
+    "What are its side effects?",
+    "Do they interact with alcohol?",
+    "Can these be crushed?",
+]
+
+
+@pytest.mark.parametrize("question", STANDALONE)
+def test_standalone_questions(question):
+    assert not is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", FOLLOW_UPS)
+def test_follow_up_questions(question):
+    assert is_follow_up(question)
+
+
+def test_empty_question_is_not_a_follow_up():
+    assert not is_follow_up("  ?  ")
+
+
+def test_standalone_question_is_not_rewritten():
+    previous = ("What is the first-line treatment for hypertension?",)
+
+    assert condense_question("What is sepsis?", previous) == "What is sepsis?"
+
+
+def test_follow_up_is_prefixed_back_to_last_standalone_question():
+    previous = (
+        "What is sepsis?",
+        "What is the first-line treatment for hypertension?",
+        "What about in children?",
+    )
+
+    assert condense_question("And in pregnancy?", previous) == (
+        "What is the first-line treatment for hypertension? What about in children? And in pregnancy?"
+    )
+
+
+class History:
+    """chat_history rows of one session, as get_user_history returns them."""
+
+    def __init__(self, monkeypatch):
+
+        self.rows = []
+        self.loads = 0
+
+        monkeypatch.setattr(conversation, "_buffers", conversation.OrderedDict())
+        monkeypatch.setattr(conversation, "get_user_history", self.get_user_history)
+        monkeypatch.setattr(conversation, "get_last_question_id", self.get_last_question_id)
+
+    def add(self, question_id, question, answer="answer"):
+        self.rows.append({"question_id": question_id, "question": question, "answer": answer})
+
+    def get_user_history(self, session_id):
+        self.loads += 1
+        return list(self.rows)
+
+    def get_last_question_id(self, session_id, before_question_id):
+        return max((row["question_id"] for row in self.rows if row["question_id"] < before_question_id), default=None)
+
+
+@pytest.fixture
+def history(monkeypatch):
+    return History(monkeypatch)
+
+
+def ask(history, question_id, question):
+    """Run one chat turn in this process: read the recent questions, then record the new one."""
+
+    history.add(question_id, question, answer=None)
+    previous = conversation.recent_questions("s", question_id)
+    conversation.record_question("s", question, question_id)
+    history.rows[-1]["answer"] = "answer"
+
+    return previous
+
+
+def test_turns_are_read_from_sql_once(history):
+
+    assert ask(history, 1, "What is sepsis?") == ()
+    assert ask(history, 2, "What about in children?") == ("What is sepsis?",)
+    assert history.loads == 1
+
+
+def test_other_sessions_in_between_keep_the_buffer(history):
+
+    ask(history, 1, "What is sepsis?")
+
+    # Ids 2-4 went to other sessions
+    assert ask(history, 5, "What about in children?") == ("What is sepsis?",)
+    assert history.loads == 1
+
+
+def test_turns_answered_by_another_worker_are_reloaded(history):
+
+    ask(history, 1, "What is sepsis?")
+
+    # Another worker answered the next turn of the same session
+    history.add(2, "What is the first-line treatment for hypertension?")
+
+    assert ask(history, 3, "What about in children?") == (
+        "What is sepsis?", "What is the first-line treatment for hypertension?"
+    )
+    assert history.loads == 2
@@ -0,0 +1,65 @@
+import re
+
+import pytest
+
+from structure_chunker import StructureChunker
+
+
+def tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True):
+
+    # One token per word
+    return {"offset_mapping": [[match.span() for match in re.finditer(r"\S+", text)] for text in texts]}
+
+
+def words(prefix, count):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def split(monkeypatch, blocks):
+
+    chunker = StructureChunker(tokenizer, chunk_size=10, chunk_overlap=4)
+    monkeypatch.setattr(chunker, "layout_blocks", lambda page: blocks)
+
+    return chunker.split_page(None, {"page": 0})
+
+
+def tokens(chunk):
+    return len(chunk.page_content.split())
+
+
+def paragraph(text):
+    return {"bbox": (0, 0, 0, 0), "text": text, "kind": "paragraph"}
+
+
+def test_overlap_is_dropped_when_it_would_overflow(monkeypatch):
+
+    # The 3-token tail fits the overlap, but tail + the 8-token block would exceed chunk_size
+    blocks = [paragraph(words("a", 5)), paragraph(words("b", 3)), paragraph(words("c", 8))]
+
+    _, chunks = split(monkeypatch, blocks)
+
+    assert [tokens(chunk) for chunk in chunks] == [8, 8]
+    assert all(tokens(chunk) <= 10 for chunk in chunks)
+
+
+def test_overlap_is_kept_when_it_fits(monkeypatch):
+
+    blocks = [paragraph(words("a", 5)), paragraph(words("b", 3)), paragraph(words("c", 4))]
+
+    _, chunks = split(monkeypatch, blocks)
+
+    assert [chunk.page_content for chunk in chunks] == [
+        words("a", 5) + "\n" + words("b", 3),
+        words("b", 3) + "\n" + words("c", 4),
+    ]
+
+
+@pytest.mark.parametrize("sizes", [[4, 4, 9, 2, 10, 1, 3], [9, 9, 9], [1] * 30])
+def test_chunks_never_exceed_chunk_size(monkeypatch, sizes):
+
+    blocks = [paragraph(words(f"p{n}_", size)) for n, size in enumerate(sizes)]
+
+    page_text, chunks = split(monkeypatch, blocks)
+
+    assert all(tokens(chunk) <= 10 for chunk in chunks)
+    assert all(chunk.page_content in page_text for chunk in chunks)
@@ -0,0 +1,30 @@
+import pytest
+
+from text_extraction import clean_extraction
+
+
+@pytest.mark.parametrize("raw, cleaned", [
+    ("pre-\nvention", "prevention"),
+    ("pre-\nvalence", "prevalence"),
+    ("co-\nagulation", "coagulation"),
+    ("anti-\nbiotics", "antibiotics"),
+    ("long-\nitudinal", "longitudinal"),
+    ("hyper-\ntension", "hypertension"),
+])
+def test_words_broken_across_lines_are_joined(raw, cleaned):
+    assert clean_extraction(raw) == cleaned
+
+
+@pytest.mark.parametrize("raw, cleaned", [
+    ("beta-\nblockers", "beta-blockers"),
+    ("first-\nline treatment", "first-line treatment"),
+    ("(long-\nterm)", "(long-term)"),
+    ("non-insulin-\ndependent", "non-insulin-dependent"),
+    ("co-\namoxiclav", "co-amoxiclav"),
+])
+def test_known_compounds_keep_their_hyphen(raw, cleaned):
+    assert clean_extraction(raw) == cleaned
+
+
+def test_dashes_after_numbers_are_left_alone():
+    assert clean_extraction("5 -\n10 mg") == "5 - 10 mg"
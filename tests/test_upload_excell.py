@@ -0,0 +1,65 @@
+import pytest
+
+import upload_excell
+from upload_excell import cluster_questions
+
+
+class FakeEmbeddings:
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+
+    fake = FakeEmbeddings({
+        "dose of amoxicillin?": [1.0, 0.0, 0.0],
+        "amoxicillin dose?": [0.99, 0.1, 0.0],
+        "what is sepsis?": [0.0, 1.0, 0.0],
+        "define sepsis": [0.05, 0.98, 0.0],
+        "is it safe in pregnancy?": [0.0, 0.0, 1.0],
+    })
+    monkeypatch.setattr(upload_excell, "embedding_model", fake)
+
+    return fake
+
+
+def test_near_duplicates_share_a_leader(embeddings):
+
+    questions = ["dose of amoxicillin?", "what is sepsis?", "amoxicillin dose?", "define sepsis", "is it safe in pregnancy?"]
+
+    assert cluster_questions(questions, threshold=0.9) == [0, 1, 0, 1, 4]
+
+
+def test_every_question_leads_itself_at_threshold_one(embeddings):
+
+    questions = ["define sepsis", "what is sepsis?", "amoxicillin dose?"]
+
+    # Float32 self-similarity is just below 1, so nothing clusters but nothing is left without a leader
+    assert cluster_questions(questions, threshold=1.0) == [0, 1, 2]
+
+
+def test_threshold_above_one_disables_clustering(embeddings):
+
+    questions = ["dose of amoxicillin?", "amoxicillin dose?"]
+
+    assert cluster_questions(questions, threshold=1.01) == [0, 1]
+
+
+def test_threshold_above_one_skips_embedding(monkeypatch):
+
+    monkeypatch.setattr(upload_excell, "embedding_model", None)
+
+    assert cluster_questions(["a", "b", "c"], threshold=2) == [0, 1, 2]
+
+
+def test_leaders_answer_before_their_members(embeddings):
+
+    questions = ["what is sepsis?", "dose of amoxicillin?", "define sepsis", "amoxicillin dose?"]
+    leaders = cluster_questions(questions, threshold=0.9)
+
+    assert all(leaders[leader] == leader and leader <= i for i, leader in enumerate(leaders))
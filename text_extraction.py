@@ -1,35 +1,102 @@
-from langchain_community.document_loaders import PyMuPDFLoader
 import hashlib
 from flask_login import current_user
 from user_auth import get_db_connection
 import re
-import os
+
+
+# Compounds that keep their hyphen when a line break falls inside them (e.g. "beta-\nblocker").
+# Matched as whole words, so ordinary words broken after "pre" or "co" are still joined
+HYPHENATED_COMPOUNDS = frozenset({
+    "age-related", "alpha-blocker", "alpha-blockers", "anti-inflammatory", "anti-inflammatories",
+    "b-cell", "b-cells", "beta-agonist", "beta-agonists", "beta-blocker", "beta-blockers",
+    "beta-lactam", "beta-lactams", "co-amoxiclav", "co-codamol", "co-trimoxazole", "dose-dependent",
+    "dose-related", "drug-induced", "drug-resistant", "first-line", "follow-up", "high-dose",
+    "high-risk", "insulin-dependent", "long-acting", "long-term", "low-dose", "low-risk",
+    "n-acetylcysteine", "non-invasive", "non-pharmacological", "non-steroidal", "post-exposure",
+    "post-operative", "post-partum", "pre-eclampsia", "pre-existing", "pre-operative",
+    "second-line", "self-care", "self-harm", "self-monitoring", "short-acting", "short-term",
+    "t-cell", "t-cells", "third-line", "time-dependent", "treatment-resistant", "well-being",
+    "x-ray", "x-rays",
+})
+
+# Ligatures, soft hyphens and unicode spacing that PDF text layers emit
+CHARACTER_TABLE = {
+    "\ufb00": "ff",
+    "\ufb01": "fi",
+    "\ufb02": "fl",
+    "\ufb03": "ffi",
+    "\ufb04": "ffl",
+    "\ufb05": "st",
+    "\ufb06": "st",
+    "\u00ad": "",
+    "\u200b": "",
+    "\ufeff": "",
+    "\u2010": "-",
+    "\u2011": "-",
+    "\u00a0": " ",
+    "\u2009": " ",
+    "\u2018": "'",
+    "\u2019": "'",
+    "\u201c": '"',
+    "\u201d": '"',
+}
+
+# str.translate is slow for non-ASCII tables, so only the rare characters are matched
+SPECIAL_CHARACTERS = re.compile("[" + "".join(CHARACTER_TABLE) + "]")
+
+# A word broken across lines, e.g. "hyper-\ntension"
+LINE_BREAK_HYPHEN = re.compile(r"-[^\S\n]*\n\s*(?=[a-z])")
+
+LETTERS = re.compile(r"[a-z]+")
+
+
+def _join_hyphenated(match):
+
+    # Look back just far enough to find the word before the hyphen
+    text = match.string
+    start = match.start()
+    words = text[max(0, start - 16):start].split()
+
+    # Leave dashes that don't follow a word alone (e.g. "5 -\n10")
+    if not words or not words[-1][-1].isalpha():
+        return match.group()
+
+    # Last part only, so "non-insulin-\ndependent" is looked up as "insulin-dependent"
+    before = words[-1].lstrip("([\"'").rsplit("-", 1)[-1].lower()
+    after = LETTERS.match(text, match.end()).group()
+
+    if f"{before}-{after}" in HYPHENATED_COMPOUNDS:
+        return "-"
+
+    return ""
 
 
 def clean_extraction(text):
-    text = re.sub(r'-\s+', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
+    # isascii() is O(1) on str, so plain ASCII pages skip this entirely
+    if not text.isascii():
+        text = SPECIAL_CHARACTERS.sub(lambda m: CHARACTER_TABLE[m.group()], text)
 
-def text_extraction(file_path):
-    pdf_name = os.path.basename(file_path)
+    # The pattern only fires at hyphens, so the callback runs rarely
+    if "-" in text:
+        text = LINE_BREAK_HYPHEN.sub(_join_hyphenated, text)
 
-    loader = PyMuPDFLoader(file_path)
-    docs = loader.load()
+    # split()/join collapses every whitespace run and strips the ends in C
+    return " ".join(text.split())
 
-    for doc in docs:
-        doc.page_content = clean_extraction(doc.page_content)
-    
-    return pdf_name, docs
 
+def file_hash(file_path):
 
-def save_to_db(pdf_name, docs):
-    
+    # The file bytes, so checking for duplicates doesn't need a text extraction pass
     hasher = hashlib.sha256()
-    for doc in docs:
-        hasher.update(doc.page_content.encode("utf-8"))
 
-    metadata_hash = hasher.hexdigest()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+
+def save_to_db(pdf_name, metadata_hash):
 
     with get_db_connection() as conn:
         
@@ -62,3 +129,67 @@ def save_to_db(pdf_name, docs):
 
 
 
+
+
+
+def get_pdf_records(pdf_names=None, uploaded_by=None, uploaded_after=None):
+
+    conditions = []
+    params = []
+
+    if pdf_names:
+        conditions.append(f"pdf_name IN ({', '.join('?' * len(pdf_names))})")
+        params.extend(pdf_names)
+
+    if uploaded_by:
+        conditions.append("uploaded_by = ?")
+        params.append(uploaded_by)
+
+    if uploaded_after:
+        conditions.append("uploaded_at >= ?")
+        params.append(uploaded_after)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute(f"""
+            SELECT pdf_name, uploaded_by, uploaded_at
+            FROM pdf_main
+            {where}
+            ORDER BY pdf_name
+        """, params)
+
+        return cursor.fetchall()
+
+
+
+def update_pdf_hash(pdf_name, metadata_hash):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            UPDATE pdf_main
+            SET metadata_hash = ?
+            WHERE pdf_name = ?
+        """, (metadata_hash, pdf_name))
+
+        conn.commit()
+
+
+def delete_pdf_record(pdf_name):
+
+    with get_db_connection() as conn:
+
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            DELETE FROM pdf_main
+            WHERE pdf_name = ?
+        """, (pdf_name,))
+
+        conn.commit()
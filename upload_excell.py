@@ -1,24 +1,97 @@
 from langchain_community.document_loaders import UnstructuredExcelLoader
-import pandas as pd
-from chat_history import update_history, update_final_answer
+from openpyxl import Workbook, load_workbook
+import csv
+import glob
+import os
+import tempfile
+from itertools import islice
+import numpy as np
+from chat_history import update_history, update_final_answer, iter_user_history, get_session_version
+from bulk_jobs import add_job_question, touch_job
+from chunking_embedding import embedding_model
 
-def extract_text_from_excell(filepath):
-    loader = UnstructuredExcelLoader(filepath, mode="elements")
-    docs = loader.load()
-    questions = []
 
-    for doc in docs:
-        if doc.page_content.lower() == 'question' or doc.page_content.lower() == 'questions':
-            pass
+QUESTION_HEADERS = {"question", "questions"}
+
+# Questions at least this similar share one generated answer; set above 1 to disable
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.92"))
+
+# Questions read, embedded and clustered together before answering
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "64"))
+
+
+def _iter_sheet_questions(sheet_name, rows):
+
+    # None until the first non-empty row decides whether there is a header
+    column = None
+
+    for row_number, row in enumerate(rows, 1):
+
+        cells = ["" if cell is None else str(cell).strip() for cell in row]
+
+        if not any(cells):
+            continue
+
+        if column is None:
+
+            headers = [cell.lower() for cell in cells]
+            column = next((i for i, h in enumerate(headers) if h in QUESTION_HEADERS), -1)
+
+            if column >= 0:
+                continue
+
+        # Without a header row, take the first filled cell of each row
+        if column >= 0:
+            question = cells[column] if column < len(cells) else ""
         else:
-            questions.append(doc.page_content)
-    
-    return questions
+            question = next(cell for cell in cells if cell)
+
+        if question:
+            yield {"sheet": sheet_name, "row": row_number, "question": question}
+
+
+def _iter_legacy_excel(filepath):
+
+    # openpyxl can't read .xls, so those still go through Unstructured
+    loader = UnstructuredExcelLoader(filepath, mode="elements")
+
+    for i, doc in enumerate(loader.lazy_load(), 1):
+        if doc.page_content.lower() not in QUESTION_HEADERS:
+            yield {"sheet": doc.metadata.get("page_name"), "row": i, "question": doc.page_content}
+
+
+def iter_questions(filepath):
+    """Yield {"sheet", "row", "question"} for each question, reading row by row."""
+
+    extension = filepath.lower().rsplit(".", 1)[-1]
+
+    if extension == "csv":
+
+        with open(filepath, newline="", encoding="utf-8-sig") as f:
+            yield from _iter_sheet_questions("csv", csv.reader(f))
+
+        return
+
+    if extension == "xls":
+        yield from _iter_legacy_excel(filepath)
+        return
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+
+    try:
+        for sheet in workbook.worksheets:
+            yield from _iter_sheet_questions(sheet.title, sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
 
 
 def save_answers_to_excel(history, file_name="answers.xlsx"):
 
-    final_data = []
+    # Write-only workbooks stream rows to disk instead of holding the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Answers")
+
+    sheet.append(["Question", "Answer", "Sources", "Confidence"])
 
     for result in history:
 
@@ -28,66 +101,190 @@ def save_answers_to_excel(history, file_name="answers.xlsx"):
             else result["answer"]
         )
 
-        final_data.append({
-            "Question": result["question"],
-            "Answer": final_answer,
-            "Sources": result["sources"],
-            "Confidence": result["confidence"]
-        })
+        sheet.append([
+            result["question"],
+            final_answer,
+            result["sources"],
+            result["confidence"]
+        ])
+
+    workbook.save(file_name)
+
+
+def get_excel_export(session_id, export_folder):
+    """Return the answers workbook for a session, rebuilding it only when the session changed."""
+
+    version = get_session_version(session_id)
+    file_path = os.path.join(export_folder, f"rag_answers_{session_id}_{version}.xlsx")
+
+    if os.path.exists(file_path):
+        return file_path
+
+    # Drop exports of older versions of this session
+    for old_file in glob.glob(os.path.join(export_folder, f"rag_answers_{session_id}_*.xlsx")):
+        try:
+            os.remove(old_file)
+        except FileNotFoundError:
+            pass
+
+    # Build under a temporary name so concurrent downloads never see a partial file
+    fd, tmp_path = tempfile.mkstemp(suffix=".xlsx", dir=export_folder)
+    os.close(fd)
+
+    save_answers_to_excel(iter_user_history(session_id), tmp_path)
+    os.replace(tmp_path, file_path)
+
+    return file_path
+
+
+
+
+def answer_question(question_id, question, rag_chain):
 
-    df = pd.DataFrame(final_data)
-    df.to_excel(file_name, index=False)
+    answer = rag_chain.invoke({
+        "question": question,
+        "question_id": question_id
+    })
 
 
+    update_final_answer(
+        question_id,
+        answer["answer"],
+        answer["sources"],
+        answer["confidence"],
+        answer["cache_id"],
+        answer["accepted"],
+        answer["edited_answer"]
+    )
 
+    return answer
 
-def excell_answer(questions, session_id, email, rag_chain):
+
+def answer_pending(pending, rag_chain, job_id):
+
+    # Rows left unanswered by an interrupted run
+    for question_id, question in pending:
+        answer_question(question_id, question, rag_chain)
+        touch_job(job_id)
+
+
+def cluster_questions(questions, threshold=DEDUP_THRESHOLD):
+    """Return, for each question, the index of the question whose answer it reuses."""
+
+    # Cosine similarity never exceeds 1, so every question answers itself
+    if threshold > 1 or not questions:
+        return list(range(len(questions)))
+
+    vectors = np.asarray(embedding_model.embed_documents(questions), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    similarity = vectors @ vectors.T
+
+    leaders = np.full(len(questions), -1)
+
+    # Greedy: each unassigned question leads every unassigned question close to it
+    for i in range(len(questions)):
+
+        if leaders[i] != -1:
+            continue
+
+        # Float32 self-similarity can land just below 1, so a leader doesn't rely on matching itself
+        leaders[i] = i
+
+        members = (similarity[i] >= threshold) & (leaders == -1)
+        leaders[members] = i
+
+    return leaders.tolist()
+
+
+def excell_answer(questions, session_id, email, rag_chain, job_id=None):
 
     all_results = []
 
-    for question in questions:
+    questions = iter(questions)
 
+    while True:
 
-        question_id = update_history(
-            email=email,
-            session_id=session_id,
-            question=question,
-            answer=None,
-            sources=None,
-            confidence=None,
-            cache_id = None,
-            accepted = None,
-            edited_answer = None
-        )
+        window = list(islice(questions, DEDUP_WINDOW))
 
+        if not window:
+            break
 
-        answer = rag_chain.invoke({
-            "question": question,
-            "question_id": question_id
-        })
+        all_results.extend(_answer_window(window, session_id, email, rag_chain, job_id))
 
+    return all_results
 
 
-        update_final_answer(
-            question_id,
-            answer["answer"],
-            answer["sources"],
-            answer["confidence"],
-            answer["cache_id"],
-            answer["accepted"],
-            answer["edited_answer"]
-        )
+def _answer_window(window, session_id, email, rag_chain, job_id):
+
+    rows = []
+
+    # Accepts plain strings or the dicts produced by iter_questions
+    for item in window:
 
+        question = item["question"] if isinstance(item, dict) else item
 
-        all_results.append({
+        if job_id and isinstance(item, dict):
+
+            # Records the question and the job checkpoint in one transaction
+            question_id = add_job_question(job_id, email, session_id, question, item["sheet"], item["row"])
+
+        else:
+
+            question_id = update_history(
+                email=email,
+                session_id=session_id,
+                question=question,
+                answer=None,
+                sources=None,
+                confidence=None,
+                cache_id = None,
+                accepted = None,
+                edited_answer = None
+            )
+
+        rows.append((item, question_id, question))
+
+
+    leaders = cluster_questions([question for _, _, question in rows])
+
+    answers = {}
+    results = []
+
+    for i, (item, question_id, question) in enumerate(rows):
+
+        leader = leaders[i]
+
+        if leader == i:
+
+            answer = answer_question(question_id, question, rag_chain)
+            answers[i] = answer
+
+        else:
+
+            # Near-duplicate: reuse the leader's answer and cache_id, so edits and approvals fan out
+            answer = answers[leader]
+
+            update_final_answer(
+                question_id,
+                answer["answer"],
+                answer["sources"],
+                answer["confidence"],
+                answer["cache_id"],
+                answer["accepted"],
+                answer["edited_answer"]
+            )
+
+        if job_id:
+            touch_job(job_id)
+
+        results.append({
+            "sheet": item.get("sheet") if isinstance(item, dict) else None,
+            "row": item.get("row") if isinstance(item, dict) else None,
             "question": question,
             "answer": answer["answer"],
             "sources": answer["sources"],
             "confidence": answer["confidence"]
         })
 
-    return all_results
-
-
-        
-
+    return results
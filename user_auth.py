@@ -1,6 +1,8 @@
 import os
+import threading
+import time
+from collections import OrderedDict
 import pyodbc
-from flask_login import UserMixin
 
 def get_db_connection():
 
@@ -16,18 +18,82 @@ def get_db_connection():
     )
 
 
-class User(UserMixin):
+class User:
+    
+    # Only what Flask-Login and the views need; the password hash is never kept on the session user
+    __slots__ = ("id", "name", "email")
+    
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
 
-    def __init__(self, user_id, name, email, password):
+    def __init__(self, user_id, name, email):
 
         self.id = user_id      
         self.name = name
         self.email = email
-        self.password = password
     
+    def get_id(self):
+        return str(self.id)
+    
+    def __eq__(self, other):
+        return isinstance(other, User) and self.get_id() == other.get_id()
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    
+    def __hash__(self):
+        return hash(self.get_id())
+
+
+###===========================================  User cache  ===================================================###
+
+
+# Nothing in the app updates user rows, so the TTL is the only invalidation; a
+# change made directly in the database shows up within USER_CACHE_TTL seconds
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+
+def _cache_get(user_id):
+
+    with _user_cache_lock:
+
+        entry = _user_cache.get(user_id)
+
+        if entry is None:
+            return None
+
+        user, expires_at = entry
 
+        if expires_at < time.monotonic():
+            del _user_cache[user_id]
+            return None
 
-def get_user_by_email(email):
+        _user_cache.move_to_end(user_id)
+
+        return user
+
+
+def _cache_put(user_id, user):
+
+    with _user_cache_lock:
+
+        _user_cache[user_id] = (user, time.monotonic() + USER_CACHE_TTL)
+        _user_cache.move_to_end(user_id)
+
+        # Evict the least recently used users
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+
+
+###===========================================  User queries  =================================================###
+
+
+def get_user_credentials(email):
 
     with get_db_connection() as conn:
 
@@ -45,17 +111,28 @@ def get_user_by_email(email):
         row = cursor.fetchone()
 
         if row:
-            return User(*row)   
+            return User(row[0], row[1], row[2]), row[3]
+
+        return None, None
+
 
 def get_user_by_id(user_id):
 
+    user_id = str(user_id)
+
+    # Flask-Login calls this on every request, so serve repeat lookups from memory
+    user = _cache_get(user_id)
+
+    if user:
+        return user
+
     with get_db_connection() as conn:
 
         cursor = conn.cursor()
 
         cursor.execute(
             """
-            SELECT user_id, user_name, email, password
+            SELECT user_id, user_name, email
             FROM user_table
             WHERE user_id = ?
             """,
@@ -65,7 +142,9 @@ def get_user_by_id(user_id):
         row = cursor.fetchone()
 
         if row:
-            return User(*row)
+            user = User(*row)
+            _cache_put(user_id, user)
+            return user
 
 
 
@@ -0,0 +1,176 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; every process runs the shared steps there
+    fcntl = None
+
+from answer_generation import similarity_search_with_score
+from chat_history import get_top_questions
+from chunking_embedding import (
+    CHROMA_PERSIST_DIR, CHROMA_PERSIST_DIR_FOR_CACHE, CHUNK_STORE_DIR, embedding_model
+)
+from model_config import env_bool, env_int, llm_config
+from semantic_caching import search_cache, store_in_chroma
+
+
+# Dummy embedding and index searches and a read of the model and index files at startup;
+# the inference processes warm the LLM themselves
+WARMUP = env_bool("WARMUP", True)
+
+# Most asked questions put back into the semantic cache; 0 disables
+WARMUP_TOP_QUESTIONS = env_int("WARMUP_TOP_QUESTIONS", 0)
+
+READ_BLOCK = 8 * 1024 * 1024
+
+WARMUP_QUESTION = "What is the recommended dose?"
+
+
+###============================================  Page cache  =============================================###
+
+
+def warm_paths():
+
+    paths = []
+
+    # Only mmap'd weights stay in the page cache for llama.cpp to map
+    config = llm_config()
+    if config["use_mmap"]:
+        paths.append(config["model_path"])
+
+    # Local index files; with a Chroma server this warms its files if it runs on this box
+    paths += [path for path in (CHROMA_PERSIST_DIR, CHROMA_PERSIST_DIR_FOR_CACHE, CHUNK_STORE_DIR) if path]
+
+    return paths
+
+
+def touch_files(paths):
+    """Read files (or every file under directories) once so later mmap reads hit memory."""
+
+    total = 0
+    buffer = bytearray(READ_BLOCK)
+
+    for path in paths:
+
+        if os.path.isdir(path):
+            files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            continue
+
+        for file_path in files:
+            with open(file_path, "rb", buffering=0) as f:
+                while True:
+                    read = f.readinto(buffer)
+                    if not read:
+                        break
+                    total += read
+
+    return total
+
+
+###=============================================  Caches  ===============================================###
+
+
+def prefill_caches(limit):
+    """Put the most asked questions back into the semantic cache.
+
+    The generation cache is left alone: its keys include today's retrieved context,
+    which the stored answers were not generated from.
+    """
+
+    questions = get_top_questions(limit)
+
+    added = 0
+
+    for row in questions:
+
+        question = row["question"]
+
+        # Entries can be missing after the cache collection was rebuilt or moved
+        if search_cache(question) is None:
+            store_in_chroma(question, row["cache_id"])
+            added += 1
+
+    return len(questions), added
+
+
+###=============================================  Warm-up  ===============================================###
+
+
+@contextmanager
+def _shared_step():
+
+    # Page cache and caches are shared, so one process does this while the others skip it
+    with open(os.path.join(tempfile.gettempdir(), "rag_warmup.lock"), "a") as lock_file:
+
+        if fcntl is None:
+            yield True
+            return
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def warm_up():
+
+    # Sequential reads first, so loading the model doesn't fault its pages in one by one
+    with _shared_step() as owner:
+        if owner:
+            start = time.perf_counter()
+            read = touch_files(warm_paths())
+            print(f"Warm-up: read {read / 1e6:.0f} MB of model and index files in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+
+    # Per process: torch kernels and the index handles. The LLM is warmed by the
+    # inference processes themselves, so web workers never load it
+    embedding_model.embed_query(WARMUP_QUESTION)
+    similarity_search_with_score(WARMUP_QUESTION, k=1)
+    search_cache(WARMUP_QUESTION)
+
+    print(f"Warm-up: embedding model and indexes ready in {time.perf_counter() - start:.1f}s (pid {os.getpid()})")
+
+    if WARMUP_TOP_QUESTIONS <= 0:
+        return
+
+    with _shared_step() as owner:
+        if owner:
+            start = time.perf_counter()
+            questions, added = prefill_caches(WARMUP_TOP_QUESTIONS)
+            print(
+                f"Warm-up: {questions} top questions, {added} added to the semantic cache "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+
+
+def start_warmup():
+
+    if not WARMUP:
+        return None
+
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            print(f"Warm-up failed: {e}")
+
+    # The server takes requests meanwhile; the first ones may still be slow
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    return thread